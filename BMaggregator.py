@@ -4,60 +4,280 @@ import time
 import os
 import pickle
 import re
+import math
+from collections import Counter
 from bmamaster import BMAMaster
-
-class Message:
-    def __init__(self, rawmsg):
-        self.fromAddress = rawmsg['fromAddress']
-        self.toAddress = rawmsg['toAddress']
-        self.msgid = rawmsg['msgid']
-        self.receivedTime = rawmsg['receivedTime']
-
-        self.subject = rawmsg['subject'].decode('base64').decode('utf-8')
-        if self.subject.lower().startswith('re:'):
-            self.subject = self.subject[3:]
-        self.subject = self.subject.strip()
-
-        self.firstChars = rawmsg['message'].decode('base64')[:150]
+from message_store import MessageStore
+from time_index import TimeIndex
+from aggregation import countSubjects, topSubjects
+from histogram import MultiResolutionHistogram, RESOLUTIONS, DAY, \
+                      splitWindow
+from report_snapshot import ReportSnapshot
+from api_user import AsyncApiUser
+from worker_pool import WorkerPool
+from ingest_node import IngestNode
+from outbound import Send
+from heavy_hitters import SpaceSaving
+from hyperloglog import HyperLogLog
+from search_index import SearchIndex
+from logger import WARNING
+from metrics import registry, timedPhase
+
+def decodeBase64Prefix(encoded, length):
+    '''decode only enough of a base64 string to get length bytes'''
+    needed = (length+2)//3*4
+    chunk = ''.join(encoded[:needed*2].split())[:needed]
+    chunk = chunk[:len(chunk)//4*4]
+    return chunk.decode('base64')[:length]
+
+subjectTable = {}
+
+def internSubject(subject):
+    '''return the shared copy of a subject string'''
+    return subjectTable.setdefault(subject, subject)
+
+class Message(object):
+    '''A tracked message. Addresses and subjects are interned, so messages
+    from the same address or thread share one copy of the string.'''
+    __slots__ = ('fromAddress', 'toAddress', 'msgid', 'receivedTime',
+                 'subject', 'firstChars', 'trashed')
+
+    def __init__(self, rawmsg=None):
+        if rawmsg is None: return
+
+        self.fromAddress = intern(str(rawmsg['fromAddress']))
+        self.toAddress = intern(str(rawmsg['toAddress']))
+        self.msgid = str(rawmsg['msgid'])
+        self.receivedTime = int(rawmsg['receivedTime'])
+
+        subject = rawmsg['subject'].decode('base64').decode('utf-8')
+        if subject.lower().startswith('re:'):
+            subject = subject[3:]
+        #interned once it is indexed, so ignored messages don't stay in
+        #subjectTable
+        self.subject = subject.strip()
+
+        self.firstChars = decodeBase64Prefix(rawmsg['message'], 150)
         self.trashed = False
 
+    @classmethod
+    def fromRow(cls, row):
+        msgid, fromAddress, toAddress, address, receivedTime, subject, \
+            firstChars, trashed = row
+        message = cls()
+        message.fromAddress = intern(str(fromAddress))
+        message.toAddress = intern(str(toAddress))
+        message.msgid = str(msgid)
+        message.receivedTime = receivedTime
+        message.subject = internSubject(subject)
+        message.firstChars = str(firstChars)
+        message.trashed = bool(trashed)
+        return message
+
+    def __getstate__(self):
+        return dict([(name, getattr(self, name)) for name in self.__slots__])
+
+    def __setstate__(self, state):
+        #also loads messages pickled before Message had __slots__
+        self.fromAddress = intern(str(state['fromAddress']))
+        self.toAddress = intern(str(state['toAddress']))
+        self.msgid = str(state['msgid'])
+        self.receivedTime = int(state['receivedTime'])
+        self.subject = internSubject(state['subject'])
+        self.firstChars = str(state['firstChars'])
+        self.trashed = state['trashed']
+
 class Aggregator(BMAMaster):
     SEPERATOR = u'~'
     CHECKINTERVAL = 3600
+    SUMMARYPERIODS = {'weekly': 7*86400, 'monthly': 30*86400}
     def __init__(self, configPath=None, apiUser=None):
         BMAMaster.__init__(self, configPath, apiUser)
         self.publishTimeFilePath = 'data/publishTime'
+        self.storeFilePath = 'data/messages.db'
         self.messageFilePath = 'data/messages.pkl'
         self.idFilePath = 'data/ids.pkl'
         self.subjectFilePath = 'data/subjects.pkl'
         self.addressFilePath = 'data/addresses.pkl'
+        self.reportSnapshot = None
+        self.store = MessageStore(self.storeFilePath)
+        self.ingestNodes = []
+        self.loadIngestNodes()
+        self.searchIndex = SearchIndex(self.store)
         self.loadPublishTime()
+        self.migratePickles()
         self.loadMessages()
-        self.loadIds()
-        self.loadSubjects()
-        self.loadAddresses()
+        self.loadHourlyCounts()
+        self.loadSubjectCounts()
+        self.loadDistinctSketches()
+        self.loadSearchIndex()
         self.addNewMessages()
 
-    def getMessages(self):
-        rawMessages = self.apiUser.getRawMessages()
-        messages = [Message(i) for i in rawMessages]
-        return [i for i in messages if self.getAddressFromMessage(i)]
-
+    def loadIngestNodes(self):
+        '''set up the main node and the ones in ingestNodes, keeping the
+        cursors and pending trash of nodes that were already known'''
+        knownNodes = dict([(node.name, node) for node in self.ingestNodes])
+        apiUsers = [('main', self.apiUser)] + sorted(self.nodeApiUsers.items())
+        self.ingestNodes = []
+        for name, apiUser in apiUsers:
+            node = knownNodes.get(name)
+            if not node:
+                node = IngestNode(name, apiUser)
+                node.ignoredMessages = self.store.getIgnoredMessages(name)
+            node.apiUser = apiUser
+            self.ingestNodes.append(node)
+
+    @timedPhase
     def getNewMessages(self):
-        inboxMessages = self.getMessages()
-        return [msg for msg in inboxMessages if msg.msgid not in self.ids]
-
+        '''fetch the tracked messages from every node's inbox in parallel
+        and return the ones that aren't stored yet
+
+        Every tracked message found on a node is queued to be trashed on
+        that node, including copies of messages already stored from
+        another node. An extra node that fails or takes longer than
+        nodeTimeout seconds is skipped until the next check, but if the
+        main node does, nothing is taken from any node and the check
+        fails.'''
+        incremental = self.config.get('ingestMode', 'full') == 'incremental'
+        #load the tracked addresses before the fetches use them
+        self.addressRegistry.ensureLoaded()
+        nodes = []
+        mainNode = self.ingestNodes[0]
+        for node in self.ingestNodes:
+            if node.busy:
+                self.logger.log('node still busy, %s' %node.name, WARNING)
+            else:
+                nodes.append(node)
+        if mainNode not in nodes:
+            raise RuntimeError('main node still busy')
+
+        pool = WorkerPool(len(nodes))
+        futures = [(node, pool.submit(self.fetchNode, node, incremental))
+                   for node in nodes]
+        deadline = time.time() + float(self.config.get('nodeTimeout', 600))
+        results = []
+        for node, future in futures:
+            try:
+                results.append((node,
+                                future.result(max(0, deadline-time.time()))))
+            except Exception as exception:
+                self.logger.log('ingest failed, %s, %s' %(node.name, exception),
+                                WARNING)
+                if node is mainNode:
+                    pool.shutdown(wait=False)
+                    raise
+        pool.shutdown(wait=False)
+
+        newMessages = {}
+        for node, (messages, heldIds, ignored, goneIds) in results:
+            for msgid in goneIds:
+                del node.ignoredMessages[msgid]
+            self.store.deleteIgnoredMessages(node.name, goneIds)
+            for msgid, toAddress, fromAddress in ignored:
+                node.ignoredMessages[msgid] = (toAddress, fromAddress)
+            self.store.addIgnoredMessages(node.name, ignored)
+            node.pendingTrash.update(heldIds)
+            for message in messages:
+                node.pendingTrash.add(message.msgid)
+                newMessages.setdefault(message.msgid, message)
+
+        return newMessages.values()
+
+    def fetchNode(self, node, incremental=False):
+        '''return (messages, heldIds, ignored, goneIds): the tracked
+        messages in a node's inbox that aren't stored yet, the msgids of
+        stored messages still in it, and in incremental mode the
+        (msgid, toAddress, fromAddress) of untracked messages not to fetch
+        again and the msgids of ignored messages no longer in the inbox'''
+        node.busy = True
+        try:
+            if incremental:
+                return self.fetchNodeIncremental(node)
+
+            messages = [Message(i) for i in node.apiUser.getRawMessages()]
+            messages = [i for i in messages if self.getAddressFromMessage(i)]
+            return ([i for i in messages if i.msgid not in self.ids],
+                    [i.msgid for i in messages if i.msgid in self.ids],
+                    [], [])
+        finally:
+            node.busy = False
+
+    def fetchNodeIncremental(self, node):
+        '''fetch only the inbox messages that haven't been fetched from
+        this node yet, or were ignored but are to an address that is
+        tracked now. A message that can't be fetched is left to the next
+        check instead of failing the node.'''
+        inboxIds = set(node.apiUser.getInboxMessageIds())
+        ignoredMessages = node.ignoredMessages
+        goneIds = [msgid for msgid in ignoredMessages
+                   if msgid not in inboxIds]
+        heldIds = [msgid for msgid in inboxIds if msgid in self.ids]
+        msgids = [msgid for msgid in inboxIds if msgid not in self.ids and
+                  (msgid not in ignoredMessages or
+                   self.getTrackedAddress(*ignoredMessages[msgid]))]
+        self.logger.log('Fetching %d unseen messages, %s'
+                        %(len(msgids), node.name))
+
+        messages = []
+        ignored = []
+        for msgid in msgids:
+            try:
+                rawmsg = node.apiUser.getRawMessage(msgid)
+            except Exception as exception:
+                self.logger.log('fetch failed, %s, %s, %s'
+                                %(node.name, msgid, exception), WARNING)
+                continue
+            if not rawmsg: continue
+            message = Message(rawmsg)
+            if self.getAddressFromMessage(message):
+                messages.append(message)
+            elif msgid not in ignoredMessages:
+                ignored.append((msgid, message.toAddress,
+                                message.fromAddress))
+
+        return messages, heldIds, ignored, goneIds
+
+    @timedPhase
     def addNewMessages(self):
         self.logger.log('Adding New Messages')
+        self.refreshAddresses()
         inboxMessages = self.getNewMessages()
-        for message in inboxMessages:
-            self.messages.append(message)
-            self.ids[message.msgid] = message
-            self.addMessageToSubject(message.subject, message)
-            self.addMessageToAddress(message)
-
+        self.storeMessages(inboxMessages)
         self.trashMessages()
 
+    @timedPhase
+    def storeMessages(self, inboxMessages):
+        inboxMessages.sort(key=lambda msg: msg.receivedTime)
+        storedMessages = []
+        for message in inboxMessages:
+            address = self.getAddressFromMessage(message)
+            self.store.addMessage(message, address)
+            self.indexMessage(message, address)
+            self.countMessage(message, address)
+            self.searchIndex.addMessage(message)
+            storedMessages.append((message, address))
+        self.addSubjectCounts(storedMessages)
+        self.addDistinctSketches(storedMessages)
+        self.reportSnapshot = None
+
+    def reloadConfig(self):
+        BMAMaster.reloadConfig(self)
+        self.loadIngestNodes()
+        self.reportSnapshot = None
+
+    def recover(self):
+        '''throw away uncommitted changes and rebuild the in-memory indexes
+        from the store, after a check failed part way through'''
+        self.store.rollback()
+        self.loadPublishTime()
+        #the nodes' cursors and pending trash may name rolled back messages
+        for node in self.ingestNodes:
+            node.ignoredMessages = self.store.getIgnoredMessages(node.name)
+            node.pendingTrash = set()
+        self.loadMessages()
+        self.loadHourlyCounts()
+        self.refreshAddresses()
+
     def loadPublishTime(self):
         if os.path.isfile(self.publishTimeFilePath):
             with open(self.publishTimeFilePath, 'r') as file:
@@ -65,115 +285,336 @@ class Aggregator(BMAMaster):
         else:
             self.publishTime = 0
 
-    def loadMessages(self):
-        if os.path.isfile(self.messageFilePath):
-            with open(self.messageFilePath, 'r') as file:
-                self.messages = pickle.load(file)
-        else:
-            self.messages = []
+        self.summaryPublishTimes = {}
+        for name in self.SUMMARYPERIODS:
+            filePath = '%s.%s' %(self.publishTimeFilePath, name)
+            if os.path.isfile(filePath):
+                with open(filePath, 'r') as file:
+                    self.summaryPublishTimes[name] = float(file.read().strip())
+            else:
+                self.summaryPublishTimes[name] = 0
+
+    def migratePickles(self):
+        '''move messages from the old pickle files into the store'''
+        if not os.path.isfile(self.messageFilePath): return
+        if not self.store.isEmpty(): return
+
+        self.logger.log('Migrating pickled messages')
+        with open(self.messageFilePath, 'r') as file:
+            messages = pickle.load(file)
+
+        messageAddresses = {}
+        if os.path.isfile(self.addressFilePath):
+            with open(self.addressFilePath, 'r') as file:
+                for address, addressMessages in pickle.load(file).items():
+                    for message in addressMessages:
+                        messageAddresses[message.msgid] = address
+
+        for message in messages:
+            address = messageAddresses.get(message.msgid)
+            if not address:
+                address = self.getAddressFromMessage(message)
+            if address:
+                self.store.addMessage(message, address)
+
+        self.store.commit()
+        for filePath in (self.messageFilePath, self.idFilePath,
+                         self.subjectFilePath, self.addressFilePath):
+            if os.path.isfile(filePath):
+                os.rename(filePath, filePath + '.migrated')
 
-    def loadIds(self):
-        if os.path.isfile(self.idFilePath):
-            with open(self.idFilePath, 'r') as file:
-                self.ids = pickle.load(file)
-        else:
-            self.ids = {}
-            for message in self.messages:
-                self.ids[message.msgid] = message
-
-    def loadSubjects(self):
-        if os.path.isfile(self.subjectFilePath):
-            with open(self.subjectFilePath, 'r') as file:
-                self.subjects = pickle.load(file)
-        else:
-            self.subjects = {}
-            for message in self.messages:
-                self.addMessageToSubject(message.subject, message)
+    def loadMessages(self):
+        self.messages = TimeIndex()
+        self.ids = {}
+        self.subjects = {}
+        self.addresses = {}
+        subjectTable.clear()
+        for row in self.store.getMessageRows():
+            self.indexMessage(Message.fromRow(row), row[3])
+        #messages stored before a restart are trashed on the main node
+        self.ingestNodes[0].pendingTrash = set(self.store.getUntrashedIds())
+
+    def loadHourlyCounts(self):
+        self.hourlyCounts = MultiResolutionHistogram()
+        if not self.store.hasHourlyCounts():
+            #build the histogram for messages stored before it existed
+            for address in self.addresses:
+                for message in self.addresses[address]:
+                    self.countMessage(message, address)
+            self.store.commit()
+            return
+
+        for address, hour, count in self.store.getHourlyCountRows():
+            self.hourlyCounts.add(address, hour, count)
+        for address, day, count in self.store.getDailyCountRows():
+            self.hourlyCounts.add(address, day, count, DAY)
+
+    def loadSubjectCounts(self):
+        '''build the subject counts for messages stored before they
+        existed'''
+        if self.store.hasSubjectCounts(): return
+
+        self.addSubjectCounts([(message, address)
+                               for address in self.addresses
+                               for message in self.addresses[address]])
+        self.store.commit()
+
+    def addSubjectCounts(self, messages):
+        '''count (message, address) pairs in the per address subject counts
+        of every resolution'''
+        subjectCounts = Counter()
+        for message, address in messages:
+            for resolution in RESOLUTIONS:
+                bucket = message.receivedTime//resolution*resolution
+                subjectCounts[(resolution, bucket, address,
+                               message.subject)] += 1
+        self.addSubjectSummaries(subjectCounts)
+
+    def addSubjectSummaries(self, subjectCounts):
+        '''add a Counter keyed by (resolution, bucket, address, subject) to
+        the SpaceSaving summaries of at most subjectCapacity subjects'''
+        capacity = int(self.config.get('subjectCapacity', 500))
+        grouped = {}
+        for (resolution, bucket, address, subject), count \
+                in subjectCounts.iteritems():
+            grouped.setdefault((resolution, bucket, address), []).append(
+                (count, subject))
+
+        for (resolution, bucket, address), counts in grouped.iteritems():
+            summary = SpaceSaving(capacity)
+            summary.load(self.store.getSubjectSummaryRows(resolution, address,
+                                                          bucket))
+            #add the most common subjects first so they are kept
+            for count, subject in sorted(counts, reverse=True):
+                summary.add(subject, count)
+            self.store.updateSubjectSummary(resolution, address, bucket,
+                                            summary)
+
+    def loadDistinctSketches(self):
+        '''build the distinct poster and thread sketches for messages
+        stored before they existed'''
+        if self.store.hasSketches(): return
+
+        self.addDistinctSketches([(message, address)
+                                  for address in self.addresses
+                                  for message in self.addresses[address]])
+        self.store.commit()
+
+    def addDistinctSketches(self, messages):
+        '''add (message, address) pairs to the per address HyperLogLog
+        sketches of posters and threads of every resolution'''
+        grouped = {}
+        for message, address in messages:
+            for resolution in RESOLUTIONS:
+                bucket = message.receivedTime//resolution*resolution
+                grouped.setdefault((resolution, bucket, address), []).append(
+                    message)
+
+        for (resolution, bucket, address), bucketMessages \
+                in grouped.iteritems():
+            for kind, attribute in (('posters', 'fromAddress'),
+                                    ('threads', 'subject')):
+                sketch = HyperLogLog(registers=self.store.getSketch(
+                    resolution, address, bucket, kind))
+                for message in bucketMessages:
+                    sketch.add(getattr(message, attribute))
+                self.store.setSketch(resolution, address, bucket, kind,
+                                     sketch.toString())
+
+    def loadSearchIndex(self):
+        '''index messages stored before the search index existed'''
+        if self.store.hasSearchTerms() or not self.messages: return
+
+        self.logger.log('Building search index')
+        for message in self.messages:
+            self.searchIndex.addMessage(message)
+        self.store.commit()
+
+    def search(self, query, addresses=None, startTime=0, endTime=None,
+               limit=20):
+        '''return up to limit (score, message) pairs matching every word
+        of query, optionally only from addresses and inside a time window'''
+        results = self.searchIndex.search(query, addresses, startTime,
+                                          endTime, limit)
+        return [(score, self.ids[msgid]) for score, msgid in results
+                if msgid in self.ids]
+
+    def countMessage(self, message, address):
+        self.hourlyCounts.add(address, message.receivedTime)
+        self.store.addHourlyCount(
+            address, self.hourlyCounts.bucketStart(message.receivedTime))
+
+    def indexMessage(self, message, address):
+        message.subject = internSubject(message.subject)
+        self.messages.add(message)
+        self.ids[message.msgid] = message
+        self.addMessageToSubject(message.subject, message)
+        self.addMessageToAddress(message, address)
 
     def addMessageToSubject(self, subject, message):
-        if subject in self.subjects:
-            self.subjects[subject].append(message)
-        else:
-            self.subjects[subject] = [message]
-
-    def loadAddresses(self):
-        if os.path.isfile(self.addressFilePath):
-            with open(self.addressFilePath, 'r') as file:
-                self.addresses = pickle.load(file)
-        else:
-            self.addresses = {}
-            for message in self.messages:
-                self.addMessageToAddress(message)
+        if subject not in self.subjects:
+            self.subjects[subject] = TimeIndex()
+        self.subjects[subject].add(message)
 
+    @timedPhase
     def saveEverything(self):
         self.logger.log('saving')
-        saveData = [(self.messageFilePath, self.messages, True),
-                    (self.idFilePath, self.ids, True),
-                    (self.subjectFilePath, self.subjects, True),
-                    (self.addressFilePath, self.addresses, True),
-                    (self.publishTimeFilePath, str(self.publishTime), False)]
-
-        for filename, data, isPickled in saveData:
-            with open(filename, 'w') as file:
-                if isPickled:
-                    pickle.dump(data, file)
-                else:
-                    file.write(data)
+        self.store.commit()
+        with open(self.publishTimeFilePath, 'w') as file:
+            file.write(str(self.publishTime))
 
+    @timedPhase
     def trashMessages(self):
+        '''trash the stored messages that are still in a node's inbox, on
+        that node'''
         self.saveEverything()
-        for msg in self.messages:
-            if msg.trashed: continue
-            self.apiUser.trashMessage(msg.msgid)
-            msg.trashed = True
-        self.saveEverything()
-        self.logger.log('messages trashed')
+        workers = int(self.config.get('trashWorkers', 4))
+        trashedCount = 0
+        failedCount = 0
+        for node in self.ingestNodes:
+            pending = sorted(node.pendingTrash)
+            node.pendingTrash = set()
+            if not pending: continue
+
+            asyncApi = AsyncApiUser(node.apiUser, min(workers, len(pending)))
+            futures = [(msgid, asyncApi.trashMessage(msgid))
+                       for msgid in pending]
+            for msgid, future in futures:
+                try:
+                    future.result()
+                except Exception as exception:
+                    self.logger.log('trash failed, %s, %s, %s'
+                                    %(node.name, msgid, exception), WARNING)
+                    node.pendingTrash.add(msgid)
+                    failedCount += 1
+                    continue
+
+                message = self.ids.get(msgid)
+                if message and not message.trashed:
+                    message.trashed = True
+                    self.store.markTrashed(msgid)
+                trashedCount += 1
+                if trashedCount % 100 == 0:
+                    self.store.commit()
+
+            asyncApi.close()
+
+        self.store.commit()
+        self.logger.log('messages trashed, %d, failed, %d'
+                        %(trashedCount, failedCount))
+
+    def refreshAddresses(self):
+        BMAMaster.refreshAddresses(self)
+        self.reportSnapshot = None
+
+    @timedPhase
+    def compactMessages(self):
+        '''drop messages older than retentionDays from the store and the
+        indexes, at most compactionBatchSize messages per call. Their
+        counts stay in the day and week counts, subject counts and
+        sketches. Their hour buckets are dropped too, so windows reaching
+        back past retentionDays are counted to the day.'''
+        retentionDays = float(self.config.get('retentionDays', 0))
+        if not retentionDays: return
+
+        cutoff = int(time.time() - retentionDays*86400)
+        batchSize = int(self.config.get('compactionBatchSize', 10000))
+        if self.messages.countBefore(cutoff) > batchSize:
+            cutoff = max(self.messages.times[batchSize],
+                         self.messages.times[0]+1)
+
+        #untrashed messages are still in the inbox, keep them until trashed
+        keep = lambda message: not message.trashed
+        messages = self.messages.removeBefore(cutoff, keep)
+        self.pruneHours(cutoff)
+        if not messages: return
+
+        addresses = set()
+        subjects = set()
+        for message in messages:
+            addresses.add(self.getIndexedAddress(message))
+            subjects.add(message.subject)
+            del self.ids[message.msgid]
 
-    def getAddressFromMessage(self, message):
-        if self.addressType(message.toAddress) == 'CHAN':
+        for address in addresses:
+            self.addresses[address].removeBefore(cutoff, keep)
+            if not self.addresses[address]:
+                del self.addresses[address]
+        for subject in subjects:
+            self.subjects[subject].removeBefore(cutoff, keep)
+            if not self.subjects[subject]:
+                del self.subjects[subject]
+                subjectTable.pop(subject, None)
+
+        msgids = [message.msgid for message in messages]
+        self.store.deleteMessages(msgids)
+        self.searchIndex.removeMessages(msgids)
+        self.store.commit()
+        self.reportSnapshot = None
+        self.logger.log('messages compacted, %d' %len(messages))
+
+    def pruneHours(self, cutoff):
+        '''drop the hour buckets of the whole days before cutoff'''
+        cutoff = cutoff//DAY*DAY
+        self.hourlyCounts.removeBefore(cutoff)
+        self.store.pruneHours(cutoff)
+        self.store.commit()
+
+    def getIndexedAddress(self, message):
+        '''the tracked address a stored message is indexed under'''
+        if message.toAddress in self.addresses:
             return message.toAddress
-        elif (self.addressType(message.fromAddress) == 'SUBSCRIPTION'
-              and message.toAddress == '[Broadcast subscribers]'):
-            return message.fromAddress
+        return message.fromAddress
+
+    def getAddressFromMessage(self, message):
+        return self.getTrackedAddress(message.toAddress, message.fromAddress)
+
+    def getTrackedAddress(self, toAddress, fromAddress):
+        '''the tracked address of a message, or None if it isn't tracked'''
+        if self.addressType(toAddress) == 'CHAN':
+            return toAddress
+        elif (self.addressType(fromAddress) == 'SUBSCRIPTION'
+              and toAddress == '[Broadcast subscribers]'):
+            return fromAddress
         else:
             return None
 
-    def addMessageToAddress(self, message):
-        address = self.getAddressFromMessage(message)
+    def addMessageToAddress(self, message, address=None):
+        if address is None:
+            address = self.getAddressFromMessage(message)
         if not address:
             raise ValueError('This message isn\'t from a tracked address')
 
-        if address in self.addresses:
-            self.addresses[address].append(message)
-        else:
-            self.addresses[address] = [message]
+        if address not in self.addresses:
+            self.addresses[address] = TimeIndex()
+        self.addresses[address].add(message)
 
     def addressType(self, address):
-        chans = self.getChanAddresses()
-        subscriptions = self.getSubscriptions()
-        if address in chans:
-            return 'CHAN'
-        elif address in subscriptions:
-            return 'SUBSCRIPTION'
-        else:
-            return 'UNKNOWN'
+        return self.addressRegistry.addressType(address)
 
     def getMessagesInTimeFrame(self, messages=None,
                                startTime=0, endTime=''):
-        if messages == None: messages = self.messages[:]
-        messages = [msg for msg in messages
-                    if int(msg.receivedTime) >= startTime
-                    and int(msg.receivedTime) <= endTime]
-        return messages
+        if messages == None: messages = self.messages
+        if isinstance(messages, TimeIndex):
+            return messages.window(startTime, endTime)
+
+        return TimeIndex(messages).window(startTime, endTime)
+
+    def getAddressCount(self, address, startTime=0, endTime=''):
+        '''number of messages from a tracked address in a time window'''
+        def rawCount(start, end):
+            if address not in self.addresses: return 0
+            return self.addresses[address].count(start, end)
+
+        return self.hourlyCounts.count(startTime, endTime, address, rawCount)
 
     def getMessageCounts(self, addresses, startTime=0, endTime=''):
         counts = []
         for address in addresses:
-            if address not in self.addresses: continue
-            messages = self.getMessagesInTimeFrame(self.addresses[address],
-                                                   startTime, endTime)
-            if messages:
-                counts.append((len(messages), address, addresses[address]))
+            if address not in self.hourlyCounts: continue
+            count = self.getAddressCount(address, startTime, endTime)
+            if count:
+                counts.append((count, address, addresses[address]))
 
         return counts
 
@@ -183,135 +624,215 @@ class Aggregator(BMAMaster):
             labelCount = 0
             addresses = labels[label]
             for address in labels[label]:
-                if address not in self.addresses: continue
-                messages = self.getMessagesInTimeFrame(self.addresses[address],
-                                                          startTime, endTime)
-                labelCount += len(messages)
+                if address not in self.hourlyCounts: continue
+                labelCount += self.getAddressCount(address, startTime, endTime)
             if labelCount:
                 counts.append((labelCount, addresses, label))
 
         return counts
 
+    def getReportSnapshot(self, startTime=None, endTime=None):
+        '''return the report snapshot for a time window, reusing the last
+        one if it covers the same window'''
+        startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
+        snapshot = self.reportSnapshot
+        if (not snapshot or snapshot.startTime != startTime
+                or snapshot.endTime != endTime):
+            snapshot = ReportSnapshot(self, startTime, endTime)
+            self.reportSnapshot = snapshot
+        return snapshot
+
+    @timedPhase
     def publishAllReports(self, startTime=None, endTime=None):
+        '''render every report, then send them all at once'''
         startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
 
-        self.publishMainReport(startTime=startTime, endTime=endTime)
-        self.publishChanReport(startTime=startTime, endTime=endTime)
-        self.publishBroadcastReport(startTime=startTime, endTime=endTime)
+        sends = self.prepareMainReport(startTime, endTime)
+        sends += self.prepareChanReport(startTime, endTime)
+        sends += self.prepareBroadcastReport(startTime, endTime)
+        self.dispatch(sends)
 
         self.publishTime = time.time()
         self.logger.log('Reports Published')
         self.saveEverything()
 
+    def getSummaryReports(self):
+        '''names of the summary reports listed in summaryReports'''
+        names = [i.strip() for i in
+                 self.config.get('summaryReports', '').split(',')]
+        return [i for i in names if i in self.SUMMARYPERIODS]
+
+    def publishSummaryReports(self):
+        '''publish the summary reports that are due'''
+        now = time.time()
+        for name in self.getSummaryReports():
+            if now >= self.summaryPublishTimes[name] + self.SUMMARYPERIODS[name]:
+                self.publishSummaryReport(name, endTime=now)
+
+    @timedPhase
+    def publishSummaryReport(self, name, endTime=None):
+        '''broadcast the main report over a weekly or monthly window, and
+        update its bittext if bittextWeekly or bittextMonthly is set'''
+        if endTime == None:
+            endTime = time.time()
+        startTime = endTime - self.SUMMARYPERIODS[name]
+        report = self.getMainReport(startTime, endTime).encode('utf-8')
+        subject = 'BMaggregator %s Report' %name.capitalize()
+        sends = [Send(self.mainAddress, subject, report)]
+        bittextId = self.config.get('bittext' + name.capitalize())
+        if bittextId:
+            sends.append(self.getBittextSend(bittextId, subject, report))
+        self.saveReport(report, startTime, endTime,
+                        'last%sReport' %name.capitalize())
+        self.dispatch(self.ignoreTimeStrings(sends, startTime, endTime))
+        self.logger.log('Report Published, %s' %name.capitalize())
+
+        self.summaryPublishTimes[name] = time.time()
+        with open('%s.%s' %(self.publishTimeFilePath, name), 'w') as file:
+            file.write(str(self.summaryPublishTimes[name]))
+
+    @timedPhase
+    def dispatch(self, sends):
+        '''send rendered Sends concurrently, retrying failed ones'''
+        self.dispatcher.dispatch(sends)
+
+    @timedPhase
     def publishMainReport(self, startTime=None, endTime=None):
+        self.dispatch(self.prepareMainReport(startTime, endTime))
+        self.logger.log('Report Published, Main')
+
+    @timedPhase
+    def publishChanReport(self, startTime=None, endTime=None):
+        self.dispatch(self.prepareChanReport(startTime, endTime))
+        self.logger.log('Report Published, Chans')
+
+    @timedPhase
+    def publishBroadcastReport(self, startTime=None, endTime=None):
+        self.dispatch(self.prepareBroadcastReport(startTime, endTime))
+        self.logger.log('Report Published, Broadcasts')
+
+    @timedPhase
+    def prepareMainReport(self, startTime=None, endTime=None):
+        '''render and save the main report, and return its Sends'''
         startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
         report = self.getMainReport(startTime, endTime).encode('utf-8')
-        self.broadcastMainReport(report, startTime, endTime)
-        self.updateMainBittext(report, startTime, endTime)
-        self.logger.log('Report Published, Main')
         self.saveReport(report, startTime, endTime, 'lastreport')
+        return self.ignoreTimeStrings([self.getMainBroadcastSend(report)] +
+                                      self.getMainBittextSends(report),
+                                      startTime, endTime)
 
-    def publishChanReport(self, startTime=None, endTime=None):
+    @timedPhase
+    def prepareChanReport(self, startTime=None, endTime=None):
+        '''render and save the chan report, and return its Sends'''
         startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
         report = self.getChanSubjectReport(startTime, endTime).encode('utf-8')
-        self.broadcastChanReport(report, startTime, endTime)
-        self.updateChanBittext(report, startTime, endTime)
-        self.logger.log('Report Published, Chans')
         self.saveReport(report, startTime, endTime, 'lastChanReport')
+        return self.ignoreTimeStrings([self.getChanBroadcastSend(report)] +
+                                      self.getChanBittextSends(report),
+                                      startTime, endTime)
 
-    def publishBroadcastReport(self, startTime=None, endTime=None):
+    @timedPhase
+    def prepareBroadcastReport(self, startTime=None, endTime=None):
+        '''render and save the broadcast report, and return its Sends'''
         startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
         report = self.getBroadcastSubjectReport(startTime, endTime).encode('utf-8')
-        self.broadcastBroadcastReport(report, startTime, endTime)
-        self.updateBroadcastBittext(report, startTime, endTime)
-        self.logger.log('Report Published, Broadcasts')
         self.saveReport(report, startTime, endTime, 'lastBroadcastReport')
+        return self.ignoreTimeStrings(
+            [self.getBroadcastBroadcastSend(report)] +
+            self.getBroadcastBittextSends(report), startTime, endTime)
+
+    def ignoreTimeStrings(self, sends, startTime, endTime):
+        '''leave a report's time window out of its sends' content hashes,
+        so a report that didn't change otherwise isn't sent again'''
+        timeStrings = self.getTimeStrings(startTime, endTime)
+        for send in sends:
+            send.volatile = timeStrings
+        return sends
+
+    def getMainBroadcastSend(self, report):
+        return Send(self.mainAddress, 'BMaggregator Report', report)
+
+    def getChanBroadcastSend(self, report):
+        return Send(self.chanAddress, 'BMaggregator Chan Report', report)
+
+    def getBroadcastBroadcastSend(self, report):
+        return Send(self.broadcastAddress, 'BMaggregator Broadcast Report',
+                    report)
+
+    def getMainBittextSends(self, report):
+        return self.getDeprecatedBittextSends('bittextMain',
+                                              'BMaggregator Report', report)
+
+    def getChanBittextSends(self, report):
+        return self.getDeprecatedBittextSends('bittextChans',
+                                              'BMaggregator Chan Report',
+                                              report)
+
+    def getBroadcastBittextSends(self, report):
+        return self.getDeprecatedBittextSends('bittextBroadcasts',
+                                              'BMaggregator Broadcast Report',
+                                              report)
+
+    def getDeprecatedBittextSends(self, key, subject, report):
+        '''Sends for a bittext and for its old id, which gets the report
+        after a deprecation notice, at most once every
+        deprecatedRefreshInterval seconds'''
+        bittextId = self.config[key]
+        oldBittextId = self.config[key + 'Old']
+
+        #old bittext
+        deprecationNotice = self.getText('reportheaders/deprecation',
+                                         newId=bittextId,
+                                         oldId=oldBittextId).encode('utf-8')
+        oldreport = deprecationNotice + report
+
+        refreshInterval = float(self.config.get('deprecatedRefreshInterval',
+                                                7*86400))
+        return [self.getBittextSend(oldBittextId, subject, oldreport,
+                                    refreshInterval),
+                self.getBittextSend(bittextId, subject, report)]
 
     def broadcastMainReport(self, report=None, startTime=None, endTime=None):
         if report==None:
             startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
             report = self.getMainReport(startTime, endTime).encode('utf-8')
 
-        subject = 'BMaggregator Report'
-        address = self.mainAddress
-        self.apiUser.sendBroadcast(address, subject, report)
+        self.dispatch([self.getMainBroadcastSend(report)])
 
     def broadcastChanReport(self, report=None, startTime=None, endTime=None):
         if report==None:
             startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
             report = self.getChanSubjectReport(startTime, endTime).encode('utf-8')
 
-        subject = 'BMaggregator Chan Report'
-        address = self.chanAddress
-        self.apiUser.sendBroadcast(address, subject, report)
+        self.dispatch([self.getChanBroadcastSend(report)])
 
     def broadcastBroadcastReport(self, report=None, startTime=None, endTime=None):
         if report==None:
             startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
             report = self.getBroadcastSubjectReport(startTime, endTime).encode('utf-8')
 
-        subject = 'BMaggregator Broadcast Report'
-        address = self.broadcastAddress
-        self.apiUser.sendBroadcast(address, subject, report)
+        self.dispatch([self.getBroadcastBroadcastSend(report)])
 
     def updateMainBittext(self, report=None, startTime=None, endTime=None):
         if report == None:
             startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
             report = self.getMainReport(startTime, endTime).encode('utf-8')
 
-        bittextId = self.config['bittextMain']
-        oldBittextId = self.config['bittextMainOld']
-
-        #old bittext
-        deprecationNotice = self.getText('reportheaders/deprecation',
-                                         newId=bittextId,
-                                         oldId=oldBittextId).encode('utf-8')
-        oldreport = deprecationNotice + report
-        self.updateBittext(oldBittextId, 'BMaggregator Report',
-                           oldreport)
-
-        #new bittext
-        self.updateBittext(bittextId, 'BMaggregator Report', report)
+        self.dispatch(self.getMainBittextSends(report))
 
     def updateChanBittext(self, report=None, startTime=None, endTime=None):
         if report == None:
             startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
             report = self.getChanSubjectReport(startTime, endTime).encode('utf-8')
 
-        bittextId = self.config['bittextChans']
-        oldBittextId = self.config['bittextChansOld']
-
-        #old bittext
-        deprecationNotice = self.getText('reportheaders/deprecation',
-                                         newId=bittextId,
-                                         oldId=oldBittextId).encode('utf-8')
-        oldreport = deprecationNotice + report
-        self.updateBittext(oldBittextId,
-                          'BMaggregator Chan Report', oldreport)
-
-        #new bittext
-        self.updateBittext(bittextId, 'BMaggregator Chan Report',
-                           report)
+        self.dispatch(self.getChanBittextSends(report))
 
     def updateBroadcastBittext(self, report=None, startTime=None, endTime=None):
         if report == None:
             startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
-            report = self.getChanSubjectReport(startTime, endTime).encode('utf-8')
-
-        bittextId = self.config['bittextBroadcasts']
-        oldBittextId = self.config['bittextBroadcastsOld']
-
-        #old bittext
-        deprecationNotice = self.getText('reportheaders/deprecation',
-                                         newId=bittextId,
-                                         oldId=oldBittextId).encode('utf-8')
-        oldreport = deprecationNotice + report
-        self.updateBittext(oldBittextId,
-                           'BMaggregator Broadcast Report', oldreport)
+            report = self.getBroadcastSubjectReport(startTime, endTime).encode('utf-8')
 
-        #new bittext
-        self.updateBittext(bittextId,
-                           'BMaggregator Broadcast Report', report)
+        self.dispatch(self.getBroadcastBittextSends(report))
 
     def saveReport(self, report=None, startTime=None, endTime=None, filename='report'):
         if report == None:
@@ -324,19 +845,7 @@ class Aggregator(BMAMaster):
         self.logger.log('Report Saved, filename')
 
     def getMainReport(self, startTime=None, endTime=None):
-        startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
-        startTimeString, endTimeString = self.getTimeStrings(startTime, endTime)
-
-        report = self.getText('reportheaders/mainReport',
-                               startTimeString=startTimeString,
-                               endTimeString=endTimeString, **self.config)
-
-        report += u'\n\nChans:\n======\n\n'
-        report += self.getRawChanSubjectReport(startTime, endTime)
-        report += u'\nBroadcasts:\n===========\n\n'
-        report += self.getRawBroadcastSubjectReport(startTime, endTime)
-
-        return report
+        return self.getReportSnapshot(startTime, endTime).getMainReport()
 
     def getHourlyReport(self, startTime=None, endTime=None,
                         interval=3600):
@@ -344,11 +853,9 @@ class Aggregator(BMAMaster):
         report = ''
         for hourStart in range(int(startTime), int(endTime), int(interval)):
             hourEnd = min((hourStart+3600, endTime))
-            count = 0
-            for msg in self.messages:
-                receivedTime = int(msg.receivedTime)
-                if receivedTime >= hourStart and receivedTime < hourEnd:
-                    count += 1
+            count = self.hourlyCounts.count(hourStart,
+                                            math.ceil(hourEnd)-1,
+                                            rawCount=self.messages.count)
 
             hourStartString, hourEndString = self.getTimeStrings(hourStart, hourEnd)
 
@@ -357,122 +864,101 @@ class Aggregator(BMAMaster):
         return report
 
     def getChanSubjectReport(self, startTime=None, endTime=None):
-        startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
-        return (self.getChanSubjectHeader(startTime, endTime) + u'\n\n' +
-                self.getRawChanSubjectReport(startTime, endTime))
+        return self.getReportSnapshot(startTime, endTime).getChanSubjectReport()
 
     def getRawChanSubjectReport(self, startTime=None, endTime=None,
                                 numberOfSubjectsToList=20):
-        startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
-        report = u''
-
-        chans = self.getLabelCounts(self.getChanLabels(), startTime, endTime)
-        chans.sort(reverse = True)
-
-        for count, addresses, label in chans:
-            chanSection = u'Name: %s\n' %label
-            chanSection += Aggregator.SEPERATOR*(6+len(label))+u'\n'
-            chanSection += u'Addresses:\n'
-
-            for address in addresses:
-                chanSection += u'  %s\n' %address
-
-            chanSection += u'\nMessages Seen: %d\n\n' %count
-
-            messages = []
-            for address in addresses:
-                messages += self.getMessagesInTimeFrame(
-                                self.addresses.get(address, []),
-                                startTime, endTime)
-
-            subjects = set([msg.subject for msg in messages])
-            subjectCounts = []
-            for subject in subjects:
-                count = len([msg for msg in messages
-                             if msg.subject==subject])
-                subjectCounts.append((count, subject))
-
-            subjectCounts.sort(key = lambda x: x[1].lower())
-            subjectCounts.sort(key = lambda x: x[0], reverse=True)
-
-            subjectHeader = ''
-            if len(subjectCounts) > numberOfSubjectsToList:
-                subjectCounts = subjectCounts[:numberOfSubjectsToList]
-                subjectHeader += u'Top %d ' %numberOfSubjectsToList
-
-            subjectHeader += u'Subjects (number of messages, subject):\n'
-            chanSection += subjectHeader
-
-            for count, subject in subjectCounts:
-                chanSection += u'  %d\t%s\n' %(count, subject)
-
-            report += chanSection + u'\n\n'
-
-        return report
+        snapshot = self.getReportSnapshot(startTime, endTime)
+        return snapshot.getRawChanSubjectReport(numberOfSubjectsToList)
+
+    def getSubjectCounts(self, addresses, startTime=0, endTime=''):
+        '''count subjects of the given addresses' messages in a time
+        window, from the coarsest subject summaries that fit inside it and
+        the stored messages at its edges. Return the counts and the set of
+        subjects whose count is approximate.'''
+        if endTime is None or endTime == '':
+            endTime = time.time()
+            if self.messages:
+                endTime = max(endTime, self.messages.times[-1])
+
+        runs, edges = splitWindow(startTime, endTime)
+        subjectCounts = countSubjects([])
+        approximate = set()
+        addresses = list(addresses)
+        for resolution, firstBucket, lastBucket in runs:
+            for subject, count, error in self.store.getSubjectCountRows(
+                    addresses, resolution, firstBucket, lastBucket):
+                subjectCounts[subject] += count
+                if error:
+                    approximate.add(subject)
+        for address in addresses:
+            if address not in self.addresses: continue
+            for edgeStart, edgeEnd in edges:
+                countSubjects(self.addresses[address].window(edgeStart,
+                                                             edgeEnd),
+                              subjectCounts)
+        return subjectCounts, approximate
+
+    def getDistinctCounts(self, addresses, startTime=0, endTime=''):
+        '''estimate the number of distinct posters and distinct threads of
+        the given addresses' messages in a time window, from the union of
+        the coarsest sketches that fit inside it and the stored messages at
+        its edges'''
+        if endTime is None or endTime == '':
+            endTime = time.time()
+            if self.messages:
+                endTime = max(endTime, self.messages.times[-1])
+
+        runs, edges = splitWindow(startTime, endTime)
+        posters = HyperLogLog()
+        threads = HyperLogLog()
+        addresses = list(addresses)
+        for sketch, kind in ((posters, 'posters'), (threads, 'threads')):
+            for resolution, firstBucket, lastBucket in runs:
+                for registers in self.store.getSketchRows(
+                        addresses, resolution, firstBucket, lastBucket, kind):
+                    sketch.update(HyperLogLog(registers=registers))
+        for address in addresses:
+            if address not in self.addresses: continue
+            for edgeStart, edgeEnd in edges:
+                for message in self.addresses[address].window(edgeStart,
+                                                              edgeEnd):
+                    posters.add(message.fromAddress)
+                    threads.add(message.subject)
+        return posters.count(), threads.count()
+
+    def getSubjectTable(self, subjectCounts, numberOfSubjectsToList=20,
+                        key=None, approximate=()):
+        subjectHeader = u''
+        if len(subjectCounts) > numberOfSubjectsToList:
+            subjectHeader += u'Top %d ' %numberOfSubjectsToList
+
+        table = subjectHeader + u'Subjects (number of messages, subject):\n'
+        for count, subject in topSubjects(subjectCounts,
+                                          numberOfSubjectsToList, key):
+            if subject in approximate:
+                table += u'  ~%d\t%s\n' %(count, subject)
+            else:
+                table += u'  %d\t%s\n' %(count, subject)
+
+        return table
 
     def getChanSubjectHeader(self, startTime=None, endTime=None):
-        startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
-        startTimeString, endTimeString = self.getTimeStrings(startTime, endTime)
-
-        return self.getText('reportheaders/chanReport',
-                             startTimeString=startTimeString,
-                             endTimeString=endTimeString,
-                             **self.config)
+        snapshot = self.getReportSnapshot(startTime, endTime)
+        return snapshot.getHeader('reportheaders/chanReport')
 
     def getBroadcastSubjectReport(self, startTime=None, endTime=None):
-        startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
-        return (self.getBroadcastSubjectHeader(startTime, endTime) + u'\n\n' +
-                self.getRawBroadcastSubjectReport(startTime, endTime))
+        snapshot = self.getReportSnapshot(startTime, endTime)
+        return snapshot.getBroadcastSubjectReport()
 
     def getRawBroadcastSubjectReport(self, startTime=None, endTime=None,
                                      numberOfSubjectsToList = 20):
-        startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
-        report = u''
-
-        broadcasts = self.getMessageCounts(self.getSubscriptions(),
-                                           startTime, endTime)
-        broadcasts.sort(reverse = True)
-
-        for count, address, label in broadcasts:
-            broadcastSection = u'Name: %s\n' %label
-            broadcastSection += Aggregator.SEPERATOR*(6+len(label))+u'\n'
-            broadcastSection += u'Address: %s\n\n' %address
-
-            messages = self.getMessagesInTimeFrame(self.addresses[address],
-                                                   startTime, endTime)
-            subjects = set([msg.subject for msg in messages])
-            subjectCounts = []
-            for subject in subjects:
-                count = len([msg for msg in messages
-                             if msg.subject==subject])
-                subjectCounts.append((count, subject))
-
-            subjectCounts.sort(key = lambda x: x[1])
-            subjectCounts.sort(key = lambda x: x[0], reverse=True)
-
-            subjectHeader = ''
-            if len(subjectCounts) > numberOfSubjectsToList:
-                subjectCounts = subjectCounts[:numberOfSubjectsToList]
-                subjectHeader += u'Top %d ' %numberOfSubjectsToList
-
-            subjectHeader += u'Subjects (number of messages, subject):\n'
-            broadcastSection += subjectHeader
-
-            for count, subject in subjectCounts:
-                broadcastSection += u'  %d\t%s\n' %(count, subject)
-
-            report += broadcastSection + u'\n\n'
-
-        return report
+        snapshot = self.getReportSnapshot(startTime, endTime)
+        return snapshot.getRawBroadcastSubjectReport(numberOfSubjectsToList)
 
     def getBroadcastSubjectHeader(self, startTime=None, endTime=None):
-        startTime, endTime = self.getDefaultTimeWindow(startTime, endTime)
-        startTimeString, endTimeString = self.getTimeStrings(startTime, endTime)
-
-        return self.getText('reportheaders/broadcastReport',
-                             startTimeString=startTimeString,
-                             endTimeString=endTimeString,
-                             **self.config)
+        snapshot = self.getReportSnapshot(startTime, endTime)
+        return snapshot.getHeader('reportheaders/broadcastReport')
 
     def getDefaultTimeWindow(self, startTime=None, endTime=None):
         if endTime == None:
@@ -490,7 +976,42 @@ class Aggregator(BMAMaster):
         endTimeString = time.asctime(time.gmtime(endTime)) + ' UTC'
         return startTimeString, endTimeString
 
-    def check(self, addNewMessages=True):
+    def check(self, addNewMessages=True, startTime=None):
+        '''run one check cycle and record how long its phases took.
+
+        A caller that has already started the cycle, to count the new
+        messages added while constructing the Aggregator, passes its
+        startTime.'''
+        if startTime is None:
+            registry.startCycle()
+            startTime = time.time()
+        try:
+            timeToNextCheck = self.runCheck(addNewMessages)
+        except Exception:
+            self.recordCycle(startTime, failed=True)
+            raise
+        self.recordCycle(startTime)
+        return timeToNextCheck
+
+    def recordCycle(self, startTime, failed=False):
+        now = time.time()
+        registry.observePhase('check', now - startTime)
+        registry.setGauge('bma_last_check_seconds', now - startTime)
+        registry.setGauge('bma_last_check_timestamp_seconds', now)
+        registry.setGauge('bma_stored_messages', len(self.messages))
+        if failed:
+            registry.increment('bma_check_failures_total')
+        self.logger.log('cycle, %s%s' %(registry.getCycleSummary(),
+                                        ', failed' if failed else ''))
+
+        statsPath = self.config.get('statsPath', 'data/stats.prom')
+        if statsPath:
+            try:
+                registry.writeFile(statsPath)
+            except IOError as exception:
+                self.logger.log('stats write failed, %s' %exception, WARNING)
+
+    def runCheck(self, addNewMessages=True):
         self.logger.log('check')
         nextPublishTime = self.publishTime + 86400
         print 'nextPublishTime', nextPublishTime
@@ -502,6 +1023,9 @@ class Aggregator(BMAMaster):
             self.publishAllReports()
             nextPublishTime = self.publishTime + 86400
 
+        self.publishSummaryReports()
+        self.compactMessages()
+
         timeToNextHour = Aggregator.CHECKINTERVAL-time.time()%Aggregator.CHECKINTERVAL
         timeToNextPublish = nextPublishTime - now
         timeToNextCheck = min((timeToNextHour,timeToNextPublish))
@@ -0,0 +1,90 @@
+class AddressRegistry:
+    '''Snapshot of the chans and subscriptions known to the Bitmessage node.
+
+    The snapshot is taken lazily on first use and kept until invalidate is
+    called, so classifying an address is a dict lookup instead of two
+    listAddresses/listSubscriptions round trips.
+
+    With extra nodes the snapshot is the union of every node's lists. If
+    an extra node can't be reached its lists from the last refresh are
+    used.'''
+    def __init__(self, apiUser, nodeApiUsers={}, logger=None):
+        self.apiUser = apiUser
+        self.nodeApiUsers = nodeApiUsers
+        self.logger = logger
+        self.nodeLists = {}
+        self.invalidate()
+
+    def invalidate(self):
+        self.loaded = False
+        self.chans = {}
+        self.chanLabels = {}
+        self.subscriptions = {}
+
+    def refresh(self):
+        addressLists = [(self.apiUser.listAddresses(),
+                         self.apiUser.listSubscriptions())]
+        for name in sorted(self.nodeApiUsers):
+            apiUser = self.nodeApiUsers[name]
+            try:
+                self.nodeLists[name] = (apiUser.listAddresses(),
+                                        apiUser.listSubscriptions())
+            except Exception as exception:
+                if self.logger:
+                    self.logger.log('address list failed, %s, %s'
+                                    %(name, exception))
+            if name in self.nodeLists:
+                addressLists.append(self.nodeLists[name])
+
+        chans = {}
+        chanLabels = {}
+        subscriptionLabels = {}
+        for addresses, subscriptions in addressLists:
+            addresses = [i for i in addresses if i['chan']]
+            for i in reversed(addresses): #list newer addresses first
+                label = i['label'][6:].strip()
+                address = i['address']
+                if address in chans: continue
+                chans[address] = label
+                if label in chanLabels:
+                    chanLabels[label].append(address)
+                else:
+                    chanLabels[label] = [address]
+
+            for i in subscriptions:
+                if i['address'] not in subscriptionLabels:
+                    subscriptionLabels[i['address']] = i['label'].decode('base64')
+
+        self.chans = chans
+        self.chanLabels = chanLabels
+        self.subscriptions = subscriptionLabels
+        self.loaded = True
+
+    def ensureLoaded(self):
+        if not self.loaded:
+            self.refresh()
+
+    def getChanAddresses(self):
+        '''return a dict mapping chan address to label'''
+        self.ensureLoaded()
+        return dict(self.chans)
+
+    def getChanLabels(self):
+        '''return a dict mapping chan labels to addresses'''
+        self.ensureLoaded()
+        return dict([(label, addresses[:]) for label, addresses
+                     in self.chanLabels.items()])
+
+    def getSubscriptions(self):
+        '''return a dict mapping subscription address to label'''
+        self.ensureLoaded()
+        return dict(self.subscriptions)
+
+    def addressType(self, address):
+        self.ensureLoaded()
+        if address in self.chans:
+            return 'CHAN'
+        elif address in self.subscriptions:
+            return 'SUBSCRIPTION'
+        else:
+            return 'UNKNOWN'
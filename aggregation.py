@@ -0,0 +1,22 @@
+import heapq
+from collections import Counter
+
+def countSubjects(messages, counts=None):
+    '''count messages per subject in a single pass'''
+    if counts is None:
+        counts = Counter()
+    for message in messages:
+        counts[message.subject] += 1
+    return counts
+
+def topSubjects(subjectCounts, number, key=None):
+    '''return the number most common (count, subject) pairs
+
+    Pairs are ordered by count, largest first, then by key(subject). Only
+    a heap of size number is kept, so the full table is never sorted.'''
+    if key is None:
+        key = lambda subject: subject
+    return [(count, subject) for subject, count in
+            heapq.nsmallest(number, subjectCounts.iteritems(),
+                            key=lambda item: (-item[1], key(item[0]),
+                                              item[0]))]
@@ -1,7 +1,17 @@
 import xmlrpclib
+import httplib
 import json
 import time
-from logger import Logger
+import metrics
+from logger import Logger, DEBUG
+from rpc_transport import PooledTransport
+from worker_pool import WorkerPool, callWithRetry
+
+#calls that are safe to repeat if the first attempt may have reached the node
+IDEMPOTENT = set(['getAllInboxMessages', 'getAllInboxMessageIds',
+                  'getInboxMessageById', 'listAddresses', 'listSubscriptions',
+                  'decodeAddress', 'getDeterministicAddress', 'trashMessage'])
+CONNECTIONERRORS = (IOError, httplib.HTTPException, xmlrpclib.ProtocolError)
 
 class ApiUser:
     def __init__(self, apiUserName=None, apiPassword=None, apiPort=None,
@@ -15,9 +25,17 @@ class ApiUser:
         if not apiPort:
             apiPort = self.config['apiPort']
 
-        apiAddress = "http://%s:%s@localhost:%s/" %(apiUserName, apiPassword,
-                                                    apiPort)
-        self.api = xmlrpclib.ServerProxy(apiAddress)
+        apiHost = self.config.get('apiHost', 'localhost')
+        self.apiAddress = "http://%s:%s@%s:%s/" %(apiUserName, apiPassword,
+                                                  apiHost, apiPort)
+        self.timeout = float(self.config.get('apiTimeout', 60))
+        self.timeouts = {}
+        self.retries = int(self.config.get('apiRetries', 2))
+        self.backoff = float(self.config.get('apiBackoff', 1))
+        self.transport = PooledTransport(int(self.config.get('apiPoolSize', 4)),
+                                         self.timeout)
+        self.api = xmlrpclib.ServerProxy(self.apiAddress,
+                                         transport=self.transport)
 
         if logger:
             self.logger = logger
@@ -25,18 +43,50 @@ class ApiUser:
             logPath = self.config['logPath']
             self.logger = Logger(logPath)
 
+    def call(self, methodName, *args):
+        '''call an api method, retrying idempotent calls that fail'''
+        self.transport.setCallTimeout(self.timeouts.get(methodName,
+                                                        self.timeout))
+        method = getattr(self.api, methodName)
+        def attempt(*args):
+            start = time.time()
+            try:
+                result = method(*args)
+            except Exception:
+                metrics.registry.observeCall(methodName, time.time() - start,
+                                             True)
+                raise
+            metrics.registry.observeCall(methodName, time.time() - start)
+            return result
+
+        if methodName in IDEMPOTENT:
+            return callWithRetry(attempt, args, self.retries, self.backoff,
+                                 CONNECTIONERRORS)
+        return attempt(*args)
+
     def getRawMessages(self):
-        inboxMessages = json.loads(self.api.getAllInboxMessages())['inboxMessages']
+        inboxMessages = json.loads(self.call('getAllInboxMessages'))['inboxMessages']
         return inboxMessages
 
+    def getInboxMessageIds(self):
+        inboxIds = json.loads(self.call('getAllInboxMessageIds'))['inboxMessageIds']
+        return [i['msgid'] for i in inboxIds]
+
+    def getRawMessage(self, msgid):
+        '''return a single raw inbox message, or None if it is gone'''
+        inboxMessage = json.loads(self.call('getInboxMessageById', msgid))['inboxMessage']
+        if inboxMessage:
+            return inboxMessage[0]
+        return None
+
     def listAddresses(self):
-        return json.loads(self.api.listAddresses())['addresses']
+        return json.loads(self.call('listAddresses'))['addresses']
 
     def listSubscriptions(self):
-        return json.loads(self.api.listSubscriptions())['subscriptions']
+        return json.loads(self.call('listSubscriptions'))['subscriptions']
 
     def decodeAddress(self, address):
-        result = self.api.decodeAddress(address)
+        result = self.call('decodeAddress', address)
         print result
         decodedAddress = json.loads(result)
         status = decodedAddress['status']
@@ -49,7 +99,7 @@ class ApiUser:
         encodedSubject = subject.encode('base64')
         encodedMessage = message.encode('base64')
         self.logger.log('Sending Broadcast, %s, %s'%(fromAddress, subject))
-        result = self.api.sendBroadcast(fromAddress, encodedSubject, encodedMessage)
+        result = self.call('sendBroadcast', fromAddress, encodedSubject, encodedMessage)
         self.logger.log('Api Result, %s'%result)
         return result
 
@@ -59,31 +109,48 @@ class ApiUser:
         encodedMessage = message.encode('base64')
         self.logger.log('Sending Message, %s, %s, %s'
                          %(toAddress, fromAddress, subject))
-        result = self.api.sendMessage(toAddress, fromAddress, encodedSubject, encodedMessage)
+        result = self.call('sendMessage', toAddress, fromAddress, encodedSubject, encodedMessage)
         self.logger.log('Api Result, %s'%result)
         return result
 
     def trashMessage(self, msgid):
-        result=self.api.trashMessage(msgid)
-        self.logger.log('Api Result, %s'%result)
+        result=self.call('trashMessage', msgid)
+        self.logger.log('Api Result, %s'%result, DEBUG)
         return result
 
     def addSubscription(self, address, label):
-        result=self.api.addSubscription(address, label)
+        result=self.call('addSubscription', address, label)
         self.logger.log('Api Result, %s'%result)
         return result
 
     def getDeterministicAddress(self, passphrase, addressVersion,
                                 streamNumber):
-        return self.api.getDeterministicAddress(passphrase, addressVersion,
-                                                streamNumber)
+        return self.call('getDeterministicAddress', passphrase,
+                         addressVersion, streamNumber)
 
     def addChan(self, passphrase, address=None, addressVersion=0, streamNumber=0):
         if address:
-            result = self.api.addChan(passphrase, address)
+            result = self.call('addChan', passphrase, address)
         else:
-            result = self.api.addChan(passphrase, addressVersion, streamNumber)
+            result = self.call('addChan', passphrase, addressVersion, streamNumber)
 
         self.logger.log('Api Result, %s'%result)
         return result
 
+class AsyncApiUser:
+    '''Runs ApiUser methods on a pool of worker threads.
+
+    Every method of the wrapped ApiUser is available and returns a Future
+    instead of waiting for the node.'''
+    def __init__(self, apiUser, workers=4):
+        self.apiUser = apiUser
+        self.pool = WorkerPool(workers)
+
+    def __getattr__(self, name):
+        method = getattr(self.apiUser, name)
+        def submit(*args):
+            return self.pool.submit(method, *args)
+        return submit
+
+    def close(self):
+        self.pool.shutdown()
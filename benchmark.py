@@ -0,0 +1,170 @@
+#!/usr/bin/python
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from logger import Logger
+from fake_bitmessage import BitmessageModel, FakeApiUser
+from BMaggregator import Aggregator
+
+USAGE = '''benchmark.py [-messages <n>[,<n>...]] [-addresses <n>] [-days <n>]
+             [-batch <n>] [-repeat <n>] [-seed <n>] [-output <file>]
+
+Runs the aggregator against an in-memory Bitmessage node and writes the
+time taken by each stage as JSON, to stdout or to the output file.'''
+
+CONFIG = '''apiUserName:benchmark
+apiPassword:benchmark
+apiPort:0
+logPath:log
+logLevel:WARNING
+mainAddress:%(mainAddress)s
+chanAddress:%(mainAddress)s
+broadcastAddress:%(mainAddress)s
+bittextAddress:%(mainAddress)s
+bittextMain:main
+bittextMainOld:mainOld
+bittextChans:chans
+bittextChansOld:chansOld
+bittextBroadcasts:broadcasts
+bittextBroadcastsOld:broadcastsOld
+bittextInfo:info
+bitcoinAddress:none
+trashWorkers:4
+'''
+
+REPORTS = ('getMainReport', 'getChanSubjectReport',
+           'getBroadcastSubjectReport', 'getHourlyReport')
+
+class Timings:
+    '''Collects the durations of named stages.'''
+    def __init__(self):
+        self.durations = {}
+
+    def add(self, name, duration):
+        self.durations.setdefault(name, []).append(duration)
+
+    def time(self, name, function, *args):
+        start = time.time()
+        result = function(*args)
+        self.add(name, time.time() - start)
+        return result
+
+    def wrap(self, instance, name):
+        '''time every call of a method of instance'''
+        method = getattr(instance, name)
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.add(name, time.time() - start)
+        setattr(instance, name, timed)
+
+    def summary(self):
+        return dict([(name, {'calls': len(durations),
+                             'seconds': sum(durations),
+                             'min': min(durations),
+                             'max': max(durations)})
+                     for name, durations in self.durations.items()])
+
+def runBenchmark(messageCount, addressCount, days=7, batchSize=10000,
+                 repeat=3, seed=0):
+    '''time each stage of the aggregator on messageCount messages spread
+    over addressCount chans and subscriptions and the last days days
+
+    Messages reach the inbox in batchSize batches, each followed by an
+    addNewMessages call, like hourly checks. The addNewMessages times
+    include the trashMessages call it makes.'''
+    packagePath = os.path.dirname(os.path.abspath(__file__))
+    oldPath = os.getcwd()
+    runPath = tempfile.mkdtemp(prefix='bmabenchmark')
+    try:
+        os.chdir(runPath)
+        os.mkdir('data')
+        shutil.copytree(os.path.join(packagePath, 'reportheaders'),
+                        'reportheaders')
+
+        chans = addressCount*7//10
+        model = BitmessageModel(chans=chans,
+                                subscriptions=addressCount-chans,
+                                seed=seed)
+        with open('config', 'w') as file:
+            file.write(CONFIG %{'mainAddress': model.mainAddress})
+        apiUser = FakeApiUser(model, Logger('log', 'WARNING'))
+        timings = Timings()
+
+        bma = Aggregator('config', apiUser)
+        timings.wrap(bma, 'trashMessages')
+        endTime = time.time()
+        startTime = endTime - days*86400
+        batches = max(1, -(-messageCount//batchSize))
+        batchSpan = (endTime - startTime)/batches
+        for batch in xrange(batches):
+            count = min(batchSize, messageCount - batch*batchSize)
+            batchStart = startTime + batch*batchSpan
+            model.addMessages(count, batchStart, batchStart + batchSpan)
+            timings.time('addNewMessages', bma.addNewMessages)
+
+        timings.time('saveEverything', bma.saveEverything)
+        bma.store.close()
+        bma = timings.time('load', Aggregator, 'config', apiUser)
+
+        windowStart = endTime - 86400
+        for i in xrange(repeat):
+            timings.time('getMessagesInTimeFrame', bma.getMessagesInTimeFrame,
+                         None, windowStart, endTime)
+            for report in REPORTS:
+                bma.reportSnapshot = None
+                timings.time(report, getattr(bma, report),
+                             windowStart, endTime)
+
+        result = {'messages': messageCount, 'addresses': addressCount,
+                  'days': days, 'batchSize': batchSize,
+                  'storedMessages': len(bma.messages),
+                  'stages': timings.summary(),
+                  'rpcCalls': dict(model.calls)}
+        bma.store.close()
+        return result
+    finally:
+        os.chdir(oldPath)
+        shutil.rmtree(runPath)
+
+def main():
+    args = sys.argv[1:]
+    options = {'-messages': '10000,100000,1000000', '-addresses': '1000',
+               '-days': '7', '-batch': '10000', '-repeat': '3', '-seed': '0'}
+    while args:
+        arg = args.pop(0)
+        if arg in options and args:
+            options[arg] = args.pop(0)
+        elif arg == '-output' and args:
+            options[arg] = args.pop(0)
+        else:
+            print USAGE
+            sys.exit(1)
+
+    results = []
+    for messageCount in options['-messages'].split(','):
+        results.append(runBenchmark(int(messageCount),
+                                    int(options['-addresses']),
+                                    float(options['-days']),
+                                    int(options['-batch']),
+                                    int(options['-repeat']),
+                                    int(options['-seed'])))
+
+    output = json.dumps({'time': time.time(),
+                         'python': platform.python_version(),
+                         'platform': platform.platform(),
+                         'results': results}, indent=2, sort_keys=True)
+    if '-output' in options:
+        with open(options['-output'], 'w') as file:
+            file.write(output + '\n')
+    else:
+        print output
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,74 @@
 import os
 import api_user
-import re
+from ingest_node import getNodeNames, getNodeConfig
 from logger import Logger
+from templates import getTemplate
+from address_registry import AddressRegistry
+from outbound import Dispatcher, Send
 ADDRESSVERSIONS = (3,4)
 
 class BMAMaster:
     def __init__(self, configPath=None, apiUser=None):
-        self.config = loadConfig(configPath)
+        self.configPath = os.path.abspath(configPath or 'config')
+        self.ownsApiUser = not apiUser
+        self.apiUser = apiUser
+        self.loadSettings()
+
+    def loadSettings(self):
+        self.configMtime = os.path.getmtime(self.configPath)
+        self.config = loadConfig(self.configPath)
         if 'runPath' in self.config:
             os.chdir(self.config['runPath'])
 
         logPath = self.config['logPath']
-        self.logger = Logger(logPath)
+        self.logger = Logger(logPath, self.config.get('logLevel', 'INFO'),
+                             int(self.config.get('logMaxBytes', 0)),
+                             float(self.config.get('logMaxAge', 0)),
+                             int(self.config.get('logBackupCount', 0)))
 
         self.mainAddress = self.config['mainAddress']
         self.bittextAddress = self.config['bittextAddress']
         self.chanAddress = self.config['chanAddress']
         self.broadcastAddress = self.config['broadcastAddress']
 
-        if apiUser:
-            self.apiUser = apiUser
-        else:
+        if self.ownsApiUser:
             self.apiUser = api_user.ApiUser(config=self.config)
 
+        self.nodeApiUsers = {}
+        for name in getNodeNames(self.config):
+            self.nodeApiUsers[name] = api_user.ApiUser(
+                config=getNodeConfig(self.config, name), logger=self.logger)
+
+        self.addressRegistry = AddressRegistry(self.apiUser,
+                                               self.nodeApiUsers, self.logger)
+        self.dispatcher = Dispatcher(
+            self.apiUser, self.logger,
+            int(self.config.get('publishWorkers', 4)),
+            int(self.config.get('publishRetries', 2)),
+            float(self.config.get('publishBackoff', 5)),
+            self.config.get('sentHashPath', 'data/sentHashes'))
+
+    def configChanged(self):
+        return os.path.getmtime(self.configPath) != self.configMtime
+
+    def reloadConfig(self):
+        self.loadSettings()
+        self.logger.log('config reloaded')
+
     def getChanAddresses(self):
         '''return a dict mapping chan address to label'''
-        addresses = self.apiUser.listAddresses()
-        return dict([(i['address'], i['label'][6:].strip()) for i in addresses
-                      if i['chan']])
+        return self.addressRegistry.getChanAddresses()
 
     def getChanLabels(self):
         '''return a dict mapping chan labels to addresses'''
-        addresses = [i for i in self.apiUser.listAddresses() if i['chan']]
-        addresses.reverse() #list newer addresses first
-        labels = {}
-        for i in addresses:
-            label = i['label'][6:].strip()
-            address = i['address']
-            if label in labels:
-                labels[label].append(address)
-            else:
-                labels[label] = [address]
-
-        return labels
+        return self.addressRegistry.getChanLabels()
 
     def getSubscriptions(self):
-        addresses = self.apiUser.listSubscriptions()
-        return dict([(i['address'], i['label'].decode('base64')) for i in addresses])
+        return self.addressRegistry.getSubscriptions()
+
+    def refreshAddresses(self):
+        '''drop the cached chan and subscription lists'''
+        self.addressRegistry.invalidate()
 
     def getChansAndSubscriptions(self):
         chans = self.getChanAddresses()
@@ -75,23 +97,18 @@ class BMAMaster:
 
         return lst
 
-    def updateBittext(self, id, subject, message):
+    def getBittextSend(self, id, subject, message, minInterval=0):
+        '''the Send that replaces the text of bittext id'''
         self.logger.log('Updating Bittext, %s, %s' %(id, subject))
-        fromAddress = self.mainAddress
-        toAddress = self.bittextAddress
         fullSubject = 'mod %s %s' %(id, subject)
-        self.apiUser.sendMessage(toAddress, fromAddress, fullSubject, message)
-
-    def getText(self, filePath, **args):
-        def sub(matchobj):
-            assert matchobj
-            key = matchobj.group(1)
-            return args[key]
+        return Send(self.mainAddress, fullSubject, message,
+                    self.bittextAddress, minInterval)
 
-        with open(filePath, 'r') as file:
-            rawText = file.read()
+    def updateBittext(self, id, subject, message):
+        self.dispatcher.dispatch([self.getBittextSend(id, subject, message)])
 
-        return re.sub(r'\$(\w+)', sub, rawText)
+    def getText(self, filePath, **args):
+        return getTemplate(filePath).render(**args)
 
 
 def loadConfig(configPath=None):
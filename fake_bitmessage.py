@@ -0,0 +1,257 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+from api_user import ApiUser
+
+BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+WORDS = ('bitmessage', 'chan', 'privacy', 'crypto', 'bitcoin', 'news',
+         'question', 'help', 'test', 'hello', 'market', 'release', 'update',
+         'proposal', 'meeting', 'spam', 'poll', 'linux', 'security', 'tor',
+         'music', 'books', 'science', 'politics', 'game', 'art', 'wiki',
+         'offer', 'free', 'daily', 'weekly', 'report', 'thread', 'anyone',
+         'new', 'old', 'best', 'why', 'how', 'what')
+
+def makeAddress(seed):
+    '''a deterministic address looking string for seed'''
+    digest = hashlib.sha512(seed).digest()
+    number = int(digest[:24].encode('hex'), 16)
+    characters = []
+    while number:
+        number, remainder = divmod(number, 58)
+        characters.append(BASE58[remainder])
+    return 'BM-' + ''.join(characters)[:34]
+
+def makeWeights(count, skew):
+    '''cumulative Zipf weights for count ranks, flat if skew is 0'''
+    weights = []
+    total = 0.0
+    for rank in xrange(count):
+        total += 1.0/(rank+1)**skew
+        weights.append(total)
+    return weights
+
+class BitmessageModel:
+    '''An in-memory Bitmessage node.
+
+    Its methods are the subset of the Bitmessage XML-RPC API that this
+    project uses, taking and returning the same encoded values, so it can
+    stand behind an ApiUser or an XML-RPC server. Messages are generated
+    for a fixed set of chans, subscriptions and senders, with subjects
+    drawn from a Zipf distribution. Every API call is counted in calls.'''
+    def __init__(self, chans=700, subscriptions=300, senders=5000,
+                 subjects=2000, subjectSkew=1.1, addressSkew=0.8,
+                 untrackedShare=0.05, bodySize=400, seed=0):
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.inbox = OrderedDict()
+        self.sent = []
+        self.nextMsgid = 0
+        self.addressInfo = {}
+
+        self.mainAddress = makeAddress('main %d' %seed)
+        self.addresses = [{'label': 'main', 'address': self.mainAddress,
+                           'stream': 1, 'enabled': True, 'chan': False}]
+        for i in xrange(chans):
+            self.addAddress('[chan] chan %d' %i,
+                            makeAddress('chan %d %d' %(seed, i)), True)
+        self.subscriptions = []
+        for i in xrange(subscriptions):
+            self.subscriptions.append(
+                {'label': ('broadcast %d' %i).encode('base64'),
+                 'address': makeAddress('subscription %d %d' %(seed, i)),
+                 'enabled': True})
+        self.senders = [makeAddress('sender %d %d' %(seed, i))
+                        for i in xrange(max(1, senders))]
+
+        self.targets = [(i['address'], i['address']) for i in self.addresses
+                        if i['chan']]
+        self.targets += [('[Broadcast subscribers]', i['address'])
+                         for i in self.subscriptions]
+        self.targetWeights = makeWeights(len(self.targets), addressSkew)
+        self.untrackedShare = untrackedShare if self.targets else 1.0
+
+        self.subjects = []
+        for i in xrange(max(1, subjects)):
+            words = self.random.sample(WORDS, self.random.randint(1, 5))
+            subject = u'%s %d' %(u' '.join(words), i)
+            self.subjects.append(subject.encode('utf-8').encode('base64'))
+        self.subjectWeights = makeWeights(len(self.subjects), subjectSkew)
+        self.replySubjects = [('Re: ' + i.decode('base64')).encode('base64')
+                              for i in self.subjects]
+
+        self.bodies = []
+        for i in xrange(16):
+            words = [self.random.choice(WORDS) for j in xrange(bodySize//6)]
+            self.bodies.append(' '.join(words).encode('base64'))
+
+    def addAddress(self, label, address, chan, addressVersion=4,
+                   streamNumber=1):
+        self.addresses.append({'label': label, 'address': address,
+                               'stream': streamNumber, 'enabled': True,
+                               'chan': chan})
+        self.addressInfo[address] = (addressVersion, streamNumber)
+
+    def pick(self, cumulativeWeights):
+        point = self.random.random()*cumulativeWeights[-1]
+        low, high = 0, len(cumulativeWeights)-1
+        while low < high:
+            middle = (low+high)//2
+            if cumulativeWeights[middle] < point:
+                low = middle+1
+            else:
+                high = middle
+        return low
+
+    def addMessages(self, count, startTime=None, endTime=None):
+        '''add count messages received between startTime and endTime,
+        defaulting to the last hour, and return their msgids'''
+        if endTime is None:
+            endTime = time.time()
+        if startTime is None:
+            startTime = endTime - 3600
+
+        msgids = []
+        for i in xrange(count):
+            if self.random.random() < self.untrackedShare:
+                toAddress = self.mainAddress
+                fromAddress = self.random.choice(self.senders)
+            else:
+                toAddress, fromAddress = self.targets[
+                    self.pick(self.targetWeights)]
+                if toAddress != '[Broadcast subscribers]':
+                    fromAddress = self.random.choice(self.senders)
+
+            subjectIndex = self.pick(self.subjectWeights)
+            if self.random.random() < 0.5:
+                subject = self.replySubjects[subjectIndex]
+            else:
+                subject = self.subjects[subjectIndex]
+
+            msgid = hashlib.sha256('%d %d' %(self.seed,
+                                             self.nextMsgid)).hexdigest()
+            self.nextMsgid += 1
+            receivedTime = int(self.random.uniform(startTime, endTime))
+            with self.lock:
+                self.inbox[msgid] = {
+                    'msgid': msgid, 'toAddress': toAddress,
+                    'fromAddress': fromAddress, 'subject': subject,
+                    'message': self.random.choice(self.bodies),
+                    'encodingType': 2, 'receivedTime': str(receivedTime),
+                    'read': 0}
+            msgids.append(msgid)
+
+        return msgids
+
+    def countCall(self, methodName):
+        with self.lock:
+            self.calls[methodName] += 1
+
+    def getAllInboxMessages(self):
+        self.countCall('getAllInboxMessages')
+        with self.lock:
+            inboxMessages = self.inbox.values()
+        return json.dumps({'inboxMessages': inboxMessages})
+
+    def getAllInboxMessageIds(self):
+        self.countCall('getAllInboxMessageIds')
+        with self.lock:
+            msgids = self.inbox.keys()
+        return json.dumps({'inboxMessageIds': [{'msgid': i} for i in msgids]})
+
+    def getInboxMessageById(self, msgid, read=None):
+        self.countCall('getInboxMessageById')
+        with self.lock:
+            message = self.inbox.get(msgid)
+        return json.dumps({'inboxMessage': [message] if message else []})
+
+    def trashMessage(self, msgid):
+        self.countCall('trashMessage')
+        with self.lock:
+            self.inbox.pop(msgid, None)
+        return 'Trashed message (assuming message existed).'
+
+    def listAddresses(self):
+        self.countCall('listAddresses')
+        with self.lock:
+            addresses = list(self.addresses)
+        return json.dumps({'addresses': addresses})
+
+    def listSubscriptions(self):
+        self.countCall('listSubscriptions')
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        return json.dumps({'subscriptions': subscriptions})
+
+    def sendBroadcast(self, fromAddress, subject, message):
+        self.countCall('sendBroadcast')
+        with self.lock:
+            self.sent.append(('[Broadcast subscribers]', fromAddress,
+                              subject, message))
+        return hashlib.sha256(fromAddress + subject + message).hexdigest()
+
+    def sendMessage(self, toAddress, fromAddress, subject, message):
+        self.countCall('sendMessage')
+        with self.lock:
+            self.sent.append((toAddress, fromAddress, subject, message))
+        return hashlib.sha256(toAddress + subject + message).hexdigest()
+
+    def addSubscription(self, address, label):
+        self.countCall('addSubscription')
+        with self.lock:
+            if address in [i['address'] for i in self.subscriptions]:
+                return 'API Error 0016: You are already subscribed to that address.'
+            self.subscriptions.append({'label': label, 'address': address,
+                                       'enabled': True})
+        return 'Added subscription.'
+
+    def decodeAddress(self, address):
+        self.countCall('decodeAddress')
+        addressVersion, streamNumber = self.addressInfo.get(address, (4, 1))
+        return json.dumps({'status': 'success',
+                           'addressVersion': addressVersion,
+                           'streamNumber': streamNumber,
+                           'ripe': hashlib.sha512(address).digest()[:20]
+                                   .encode('base64').strip()})
+
+    def getDeterministicAddress(self, passphrase, addressVersion,
+                                streamNumber):
+        self.countCall('getDeterministicAddress')
+        return makeAddress('%s %s %s' %(passphrase.decode('base64'),
+                                        addressVersion, streamNumber))
+
+    def addChan(self, passphrase, addressOrVersion=4, streamNumber=1):
+        self.countCall('addChan')
+        decodedPassphrase = passphrase.decode('base64')
+        if isinstance(addressOrVersion, basestring):
+            address = addressOrVersion
+            addressVersion, streamNumber = self.addressInfo.get(address,
+                                                                 (4, 1))
+        else:
+            addressVersion = addressOrVersion or 4
+            streamNumber = streamNumber or 1
+            address = makeAddress('%s %s %s' %(decodedPassphrase,
+                                               addressVersion, streamNumber))
+        with self.lock:
+            if address in [i['address'] for i in self.addresses]:
+                return 'API Error 0024: Chan address is already present.'
+            self.addAddress('[chan] ' + decodedPassphrase, address, True,
+                            addressVersion, streamNumber)
+        return 'Added chan %s' %address
+
+class FakeApiUser(ApiUser):
+    '''An ApiUser that calls a BitmessageModel directly instead of going
+    over XML-RPC.'''
+    def __init__(self, model, logger):
+        self.config = {}
+        self.model = model
+        self.timeout = 0
+        self.timeouts = {}
+        self.logger = logger
+
+    def call(self, methodName, *args):
+        return getattr(self.model, methodName)(*args)
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+import xmlrpclib
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from SocketServer import ThreadingMixIn
+from fake_bitmessage import BitmessageModel
+
+USAGE = '''fake_node.py [-port <n>] [-messages <n>] [-chans <n>]
+             [-subscriptions <n>] [-growth <messages per minute>]
+             [-latency <seconds>] [-jitter <seconds>]
+             [-failureRate <0-1>] [-failureMode fault|drop|mixed]
+             [-notify <path>] [-statsInterval <seconds>] [-seed <n>]
+
+Serves a fake Bitmessage node's XML-RPC API on localhost, for running
+loop.py and handler.py against. Point apiPort in config and handlerconfig
+at -port.'''
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if self.server.node.shouldFail('drop'):
+            #close the connection without answering, like a node that died
+            self.server.node.model.countCall('droppedRequests')
+            self.close_connection = 1
+            return
+        SimpleXMLRPCRequestHandler.do_POST(self)
+
+class Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class FakeNode:
+    '''Serves a BitmessageModel over XML-RPC.
+
+    Every call waits latency seconds, plus up to jitter seconds more.
+    failureRate of the calls fail, either with an XML-RPC fault or by
+    dropping the connection, depending on failureMode. The inbox grows by
+    growth messages a minute, and notifyPath is run with "newMessage"
+    after each batch, like Bitmessage's apinotifypath.'''
+    def __init__(self, model, port=8442, latency=0, jitter=0, failureRate=0,
+                 failureMode='fault', growth=0, notifyPath=None, seed=0):
+        self.model = model
+        self.latency = latency
+        self.jitter = jitter
+        self.failureRate = failureRate
+        self.failureMode = failureMode
+        self.growth = growth
+        self.notifyPath = notifyPath
+        self.random = random.Random(seed)
+        self.server = Server(('localhost', port), requestHandler=RequestHandler,
+                             logRequests=False, allow_none=True)
+        self.server.node = self
+        self.server.register_instance(self)
+
+    def shouldFail(self, mode):
+        if self.failureMode not in (mode, 'mixed'): return False
+        if self.failureMode == 'mixed' and self.random.random() < 0.5:
+            return False
+        return self.random.random() < self.failureRate
+
+    def _dispatch(self, methodName, params):
+        if methodName == 'fakeNodeStats':
+            return json.dumps(dict(self.model.calls))
+        method = getattr(self.model, methodName, None)
+        if methodName.startswith('_') or not callable(method):
+            raise xmlrpclib.Fault(20, 'Invalid method: %s' %methodName)
+
+        delay = self.latency + self.random.random()*self.jitter
+        if delay:
+            time.sleep(delay)
+        if self.shouldFail('fault'):
+            self.model.countCall('faults')
+            raise xmlrpclib.Fault(1, 'injected failure in %s' %methodName)
+        return method(*params)
+
+    def grow(self):
+        interval = max(1.0, 60.0/self.growth)
+        count = max(1, int(round(self.growth*interval/60.0)))
+        while True:
+            time.sleep(interval)
+            self.model.addMessages(count, time.time() - interval)
+            if self.notifyPath:
+                subprocess.Popen([self.notifyPath, 'newMessage'])
+
+    def printStats(self, interval):
+        while True:
+            time.sleep(interval)
+            print time.ctime(), json.dumps(dict(self.model.calls),
+                                           sort_keys=True)
+            sys.stdout.flush()
+
+    def serve(self, statsInterval=0):
+        if self.growth:
+            thread = threading.Thread(target=self.grow)
+            thread.daemon = True
+            thread.start()
+        if statsInterval:
+            thread = threading.Thread(target=self.printStats,
+                                      args=(statsInterval,))
+            thread.daemon = True
+            thread.start()
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            print json.dumps(dict(self.model.calls), sort_keys=True)
+
+def main():
+    args = sys.argv[1:]
+    options = {'-port': '8442', '-messages': '1000', '-chans': '70',
+               '-subscriptions': '30', '-growth': '0', '-latency': '0',
+               '-jitter': '0', '-failureRate': '0', '-failureMode': 'fault',
+               '-notify': '', '-statsInterval': '0', '-seed': '0'}
+    while args:
+        arg = args.pop(0)
+        if arg in options and args:
+            options[arg] = args.pop(0)
+        else:
+            print USAGE
+            sys.exit(1)
+    if options['-failureMode'] not in ('fault', 'drop', 'mixed'):
+        print USAGE
+        sys.exit(1)
+
+    seed = int(options['-seed'])
+    model = BitmessageModel(chans=int(options['-chans']),
+                            subscriptions=int(options['-subscriptions']),
+                            seed=seed)
+    now = time.time()
+    model.addMessages(int(options['-messages']), now - 86400, now)
+    node = FakeNode(model, int(options['-port']),
+                    float(options['-latency']), float(options['-jitter']),
+                    float(options['-failureRate']), options['-failureMode'],
+                    float(options['-growth']), options['-notify'] or None,
+                    seed)
+    print 'fake node listening on localhost:%s, main address %s' \
+          %(options['-port'], model.mainAddress)
+    sys.stdout.flush()
+    node.serve(float(options['-statsInterval']))
+
+if __name__ == '__main__':
+    main()
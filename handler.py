@@ -3,16 +3,53 @@
 import os
 import sys
 import re
+import socket
+import threading
+import Queue
 from bmamaster import *
+from logger import DEBUG
 CONFIGPATH = 'handlerconfig'
+COMMANDS = ('newMessage', 'update')
 
 class Handler(BMAMaster):
     def __init__(self, configPath=CONFIGPATH, apiUser=None):
         BMAMaster.__init__(self, configPath, apiUser)
+        self.seenIds = set()
+
+    def runCommand(self, command, incremental=False):
+        #the node's addresses may have changed since the last command
+        self.refreshAddresses()
+        if command == 'newMessage':
+            if incremental:
+                allmsgs = self.getUnseenRawMessages()
+            else:
+                allmsgs = self.apiUser.getRawMessages()
+            filteredmsgs = self.filterMessages(allmsgs)
+            print 'all messages:', len(allmsgs)
+            print 'direct messages:', len(filteredmsgs)
+            #messages that aren't for us are never looked at again
+            filteredIds = set([i['msgid'] for i in filteredmsgs])
+            self.seenIds.update([i['msgid'] for i in allmsgs
+                                 if i['msgid'] not in filteredIds])
+            self.processMessages(filteredmsgs)
+        elif command == 'update':
+            self.updateAddressBittext()
+
+    def getUnseenRawMessages(self):
+        '''fetch only the inbox messages this handler hasn't looked at.
+        A message is only marked seen once it has been handled, so one
+        that failed is looked at again on the next scan.'''
+        inboxIds = set(self.apiUser.getInboxMessageIds())
+        self.seenIds &= inboxIds
+        messages = []
+        for msgid in inboxIds - self.seenIds:
+            message = self.apiUser.getRawMessage(msgid)
+            if message:
+                messages.append(message)
+
+        return messages
 
     def filterMessages(self, messages):
-        addresses = self.apiUser.listAddresses()
-        addressDict = dict([(a['address'], a) for a in addresses])
         filteredMessages = []
         receivingAddresses = (self.config['mainAddress'], self.config['chanAddress'],
                               self.config['broadcastAddress'])
@@ -33,6 +70,7 @@ class Handler(BMAMaster):
             self.logger.log('command, %s, %s' %(command, details))
             if command == 'ignore':
                 ignoreCount += 1
+                self.seenIds.add(message['msgid'])
                 continue
             elif command == 'subscription':
                 encodedLabel = details.encode('utf-8').encode('base64')
@@ -41,6 +79,7 @@ class Handler(BMAMaster):
                 result = self.apiUser.addSubscription(address, encodedLabel)
                 self.logger.log('addSubscription result, %s' %result)
                 if 'Added subscription' in result:
+                    self.refreshAddresses()
                     self.confirmSubscription(address, details)
                     addedAddress = True
                 elif 'API Error 0016' in result:
@@ -90,6 +129,7 @@ class Handler(BMAMaster):
                             break
 
                     if added:
+                        self.refreshAddresses()
                         self.confirmChan(address, details)
                         addedAddress = True
             elif command == 'channoname':
@@ -98,9 +138,11 @@ class Handler(BMAMaster):
                 self.logger.log('bittext mod confirmed, ' + details)
             else:
                 self.logger.log('UNRECOGNIZED COMMAND!, ' + command)
+                self.seenIds.add(message['msgid'])
                 continue
 
             self.trashMessage(message)
+            self.seenIds.add(message['msgid'])
 
         if addedAddress:
             self.updateAddressBittext()
@@ -137,7 +179,8 @@ class Handler(BMAMaster):
         msgid = message['msgid']
         subject = message['subject'].decode('base64')
         fromAddress = message['fromAddress']
-        self.logger.log('trashing, %s, %s, %s' %(msgid, subject, fromAddress))
+        self.logger.log('trashing, %s, %s, %s' %(msgid, subject, fromAddress),
+                        DEBUG)
         self.apiUser.trashMessage(msgid)
 
     def parseSubject(self, subject):
@@ -154,6 +197,86 @@ class Handler(BMAMaster):
         else:
             return ('ignore', '')
 
+class HandlerService:
+    '''Long running Handler that takes commands from a unix socket.
+
+    Commands that arrive while the handler is busy are queued and
+    coalesced, so a burst of newMessage notifications results in a single
+    inbox scan.'''
+    def __init__(self, handler):
+        self.handler = handler
+        self.socketPath = getSocketPath(handler.config)
+        self.commands = Queue.Queue()
+
+    def listen(self):
+        if os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socketPath)
+        server.listen(16)
+        while True:
+            connection, address = server.accept()
+            try:
+                command = connection.makefile().readline().strip()
+                if command in COMMANDS:
+                    self.commands.put(command)
+                    connection.sendall('queued\n')
+                else:
+                    connection.sendall('unknown command\n')
+            except socket.error as exception:
+                self.handler.logger.log('socket error, %s' %exception)
+            finally:
+                connection.close()
+
+    def getCommands(self):
+        '''wait for a command, then take every other queued one with it'''
+        commands = set([self.commands.get()])
+        while True:
+            try:
+                commands.add(self.commands.get_nowait())
+            except Queue.Empty:
+                return commands
+
+    def work(self):
+        while True:
+            commands = self.getCommands()
+            for command in COMMANDS:
+                if command not in commands: continue
+                self.handler.logger.log('service command, ' + command)
+                try:
+                    self.handler.runCommand(command, incremental=True)
+                except Exception as exception:
+                    self.handler.logger.log('service Error!!, %s, %s'
+                                            %(type(exception), exception))
+
+    def serve(self):
+        listener = threading.Thread(target=self.listen)
+        listener.daemon = True
+        listener.start()
+        self.commands.put('newMessage')
+        self.work()
+
+def getSocketPath(config):
+    socketPath = config.get('handlerSocketPath', 'handler.sock')
+    return os.path.expanduser(os.path.join(config.get('runPath', ''),
+                                           socketPath))
+
+def notifyService(command, configPath=CONFIGPATH):
+    '''pass a command to a running HandlerService, return False if there
+    isn't one'''
+    socketPath = getSocketPath(loadConfig(configPath))
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socketPath)
+        client.sendall(command + '\n')
+        client.recv(64)
+    except socket.error:
+        return False
+    finally:
+        client.close()
+
+    return True
+
 def main():
     args = sys.argv[1:]
     if len(args):
@@ -161,17 +284,16 @@ def main():
     else:
         arg = ''
 
+    if arg in COMMANDS and notifyService(arg):
+        return
+
     handler = Handler()
     handler.logger.log('arg, ' + arg)
 
-    if arg == 'newMessage':
-        allmsgs = handler.apiUser.getRawMessages()
-        filteredmsgs = handler.filterMessages(allmsgs)
-        print 'all messages:', len(allmsgs)
-        print 'direct messages:', len(filteredmsgs)
-        handler.processMessages(filteredmsgs)
-    elif arg == 'update':
-        handler.updateAddressBittext()
+    if arg == 'serve':
+        HandlerService(handler).serve()
+    else:
+        handler.runCommand(arg)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,59 @@
+class SpaceSaving:
+    '''Space-Saving summary of the most frequent items of a stream
+    (Metwally, Agrawal and El Abbadi, 2005).
+
+    At most capacity items are counted. An item that arrives when the
+    summary is full replaces the item with the smallest count, and starts
+    from that count, which becomes its error. For a stream of n items:
+
+    -no count is lower than its item's true frequency, or higher by more
+     than its error, and no error is more than n/capacity
+    -every item with a true frequency above n/capacity is in the summary
+
+    Until more than capacity distinct items have been seen nothing is
+    replaced and every count is exact. A capacity of 0 never replaces
+    anything.
+
+    These bounds hold for one summary. Adding up several summaries, as
+    the subject counts of a window do, can also undercount: an item is
+    missing from a full summary it was replaced in, and loses up to that
+    summary's smallest count.
+
+    changed and removed collect the items added or dropped since the
+    summary was loaded, so only those need to be written back.'''
+    def __init__(self, capacity=0):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.changed = set()
+        self.removed = set()
+
+    def load(self, rows):
+        '''load (item, count, error) rows'''
+        for item, count, error in rows:
+            self.counts[item] = count
+            self.errors[item] = error
+
+    def add(self, item, count=1):
+        if item in self.counts:
+            self.counts[item] += count
+        elif not self.capacity or len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            smallest = min(self.counts, key=lambda i: (self.counts[i], i))
+            smallestCount = self.counts.pop(smallest)
+            del self.errors[smallest]
+            self.changed.discard(smallest)
+            self.removed.add(smallest)
+            self.counts[item] = smallestCount + count
+            self.errors[item] = smallestCount
+        self.removed.discard(item)
+        self.changed.add(item)
+
+    def isExact(self):
+        return not any(self.errors.itervalues())
+
+    def getRows(self, items):
+        '''return (item, count, error) rows for items'''
+        return [(item, self.counts[item], self.errors[item]) for item in items]
@@ -0,0 +1,153 @@
+import math
+
+HOUR = 3600
+DAY = 24*HOUR
+WEEK = 7*DAY
+#coarsest first, each a multiple of the next
+RESOLUTIONS = (WEEK, DAY, HOUR)
+
+class BucketHistogram:
+    '''Message counts per address in fixed size time buckets.
+
+    Counting a window adds up the buckets that lie completely inside it and
+    asks rawCount(start, end) for the partial buckets at the edges.'''
+    def __init__(self, bucketSize=HOUR):
+        self.bucketSize = bucketSize
+        self.buckets = {}
+        self.totals = {}
+
+    def bucketStart(self, timestamp):
+        return int(timestamp)//self.bucketSize*self.bucketSize
+
+    def add(self, address, timestamp, count=1):
+        bucket = self.bucketStart(timestamp)
+        addressBuckets = self.buckets.setdefault(address, {})
+        addressBuckets[bucket] = addressBuckets.get(bucket, 0) + count
+        self.totals[bucket] = self.totals.get(bucket, 0) + count
+
+    def __contains__(self, address):
+        return address in self.buckets
+
+    def removeBefore(self, cutoff):
+        '''drop the buckets that start before cutoff'''
+        for address in self.buckets.keys():
+            addressBuckets = self.buckets[address]
+            for bucket in [i for i in addressBuckets if i < cutoff]:
+                del addressBuckets[bucket]
+            if not addressBuckets:
+                del self.buckets[address]
+        for bucket in [i for i in self.totals if i < cutoff]:
+            del self.totals[bucket]
+
+    def count(self, startTime=0, endTime=None, address=None, rawCount=None):
+        '''count messages with startTime <= receivedTime <= endTime
+
+        If address is None all addresses are counted.'''
+        if address is None:
+            buckets = self.totals
+        else:
+            buckets = self.buckets.get(address, {})
+
+        if not buckets:
+            return 0
+
+        start = int(math.ceil(startTime))
+        if endTime is None or endTime == '':
+            end = max(buckets) + self.bucketSize - 1
+        else:
+            end = int(math.floor(endTime))
+        if start > end:
+            return 0
+
+        firstBucket = -(-start//self.bucketSize)*self.bucketSize
+        lastBucket = (end+1)//self.bucketSize*self.bucketSize
+        if firstBucket >= lastBucket:
+            return rawCount(start, end) if rawCount else 0
+
+        if (lastBucket-firstBucket)//self.bucketSize > len(buckets):
+            total = sum(count for bucket, count in buckets.iteritems()
+                        if firstBucket <= bucket < lastBucket)
+        else:
+            total = sum(buckets.get(bucket, 0) for bucket in
+                        xrange(firstBucket, lastBucket, self.bucketSize))
+
+        if rawCount:
+            if start < firstBucket:
+                total += rawCount(start, firstBucket-1)
+            if lastBucket <= end:
+                total += rawCount(lastBucket, end)
+
+        return total
+
+class MultiResolutionHistogram:
+    '''Message counts per address in week, day and hour buckets.
+
+    A window is counted from the coarsest buckets that fit inside it, then
+    finer buckets for what is left at the edges, and rawCount(start, end)
+    for the partial hours at the very edges.
+
+    The hour buckets of old messages can be dropped with removeBefore,
+    leaving their day and week buckets.'''
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.levels = [BucketHistogram(resolution)
+                       for resolution in resolutions]
+
+    def bucketStart(self, timestamp):
+        '''start of the finest bucket holding timestamp'''
+        return self.levels[-1].bucketStart(timestamp)
+
+    def add(self, address, timestamp, count=1, resolution=0):
+        '''add to the buckets no finer than resolution'''
+        for level in self.levels:
+            if level.bucketSize >= resolution:
+                level.add(address, timestamp, count)
+
+    def __contains__(self, address):
+        return address in self.levels[0]
+
+    def removeBefore(self, cutoff):
+        '''drop the finest buckets that start before cutoff'''
+        self.levels[-1].removeBefore(cutoff)
+
+    def count(self, startTime=0, endTime=None, address=None, rawCount=None):
+        '''count messages with startTime <= receivedTime <= endTime
+
+        If address is None all addresses are counted.'''
+        def countLevel(i, start, end):
+            if i == len(self.levels):
+                return rawCount(start, end) if rawCount else 0
+            return self.levels[i].count(start, end, address,
+                                        lambda start, end:
+                                            countLevel(i+1, start, end))
+
+        return countLevel(0, startTime, endTime)
+
+def splitWindow(start, end, resolutions=RESOLUTIONS):
+    '''split the window start <= t <= end into runs of whole buckets and
+    raw edges
+
+    Returns (runs, edges). runs are (resolution, firstBucket, lastBucket)
+    tuples, using the coarsest resolution that fits each part of the
+    window. edges are (start, end) parts too short for the finest
+    resolution.'''
+    runs = []
+    edges = []
+    def split(start, end, level):
+        if start > end: return
+        if level == len(resolutions):
+            edges.append((start, end))
+            return
+
+        resolution = resolutions[level]
+        firstBucket = -(-start//resolution)*resolution
+        endBucket = (end+1)//resolution*resolution
+        if firstBucket >= endBucket:
+            split(start, end, level+1)
+            return
+
+        runs.append((resolution, firstBucket, endBucket-resolution))
+        split(start, firstBucket-1, level+1)
+        split(endBucket, end, level+1)
+
+    split(int(math.ceil(start)), int(math.floor(end)), 0)
+    return runs, edges
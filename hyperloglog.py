@@ -0,0 +1,83 @@
+import hashlib
+import math
+import struct
+
+class HyperLogLog:
+    '''HyperLogLog sketch of the number of distinct items added to it
+    (Flajolet, Fusy, Gandouet and Meunier, 2007).
+
+    The sketch is 2**precision one byte registers. Its estimate has a
+    standard error of about 1.04/sqrt(2**precision), 3.3% at the default
+    precision of 10, and small counts are estimated by linear counting,
+    which is close to exact. update merges another sketch of the same
+    precision, giving the sketch of the union of both sets.
+
+    Most sketches only see a few items, so until a quarter of the
+    registers are set they are kept sparse, as a dict of the set registers,
+    which is cheaper to store and to merge.'''
+    def __init__(self, precision=10, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.sparse = {}
+        self.registers = None
+        if registers is None:
+            return
+        registers = str(registers)
+        if len(registers) == self.size:
+            self.registers = bytearray(registers)
+        else:
+            for i in xrange(0, len(registers), 3):
+                index, rank = struct.unpack('>HB', registers[i:i+3])
+                self.sparse[index] = rank
+
+    def add(self, item):
+        if isinstance(item, unicode):
+            item = item.encode('utf-8')
+        value = struct.unpack('>Q', hashlib.sha1(item).digest()[:8])[0]
+        index = value >> (64 - self.precision)
+        rest = value & ((1 << (64 - self.precision)) - 1)
+        self.setRegister(index, 64 - self.precision - rest.bit_length() + 1)
+
+    def setRegister(self, index, rank):
+        if self.registers is not None:
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+        elif rank > self.sparse.get(index, 0):
+            self.sparse[index] = rank
+            if len(self.sparse) > self.size//4:
+                self.densify()
+
+    def densify(self):
+        self.registers = bytearray(self.size)
+        for index, rank in self.sparse.iteritems():
+            self.registers[index] = rank
+        self.sparse = {}
+
+    def update(self, other):
+        if other.registers is None:
+            for index, rank in other.sparse.iteritems():
+                self.setRegister(index, rank)
+            return
+        if self.registers is None:
+            self.densify()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        size = self.size
+        if self.registers is None:
+            zeros = size - len(self.sparse)
+            total = zeros + sum([2.0**-i for i in self.sparse.itervalues()])
+        else:
+            zeros = self.registers.count('\x00')
+            total = sum([2.0**-i for i in self.registers])
+        alpha = 0.7213/(1 + 1.079/size)
+        estimate = alpha*size*size/total
+        if estimate <= 2.5*size and zeros:
+            estimate = size*math.log(float(size)/zeros)
+        return int(round(estimate))
+
+    def toString(self):
+        if self.registers is not None:
+            return str(self.registers)
+        return ''.join([struct.pack('>HB', index, rank)
+                        for index, rank in sorted(self.sparse.iteritems())])
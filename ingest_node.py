@@ -0,0 +1,30 @@
+class IngestNode:
+    '''A Bitmessage node the Aggregator reads its inbox from.
+
+    Each node has its own ApiUser and its own cursor: ignoredMessages, the
+    untracked messages in its inbox that have already been fetched, as
+    msgid: (toAddress, fromAddress). It is kept in the message store, so
+    a new Aggregator doesn't fetch them again. pendingTrash holds the msgids of stored messages
+    still to be trashed on this node. busy is set while a fetch runs, so a
+    node that is still stuck in the last cycle's fetch is skipped.'''
+    def __init__(self, name, apiUser):
+        self.name = name
+        self.apiUser = apiUser
+        self.ignoredMessages = {}
+        self.pendingTrash = set()
+        self.busy = False
+
+def getNodeNames(config):
+    '''names of the extra nodes listed in ingestNodes'''
+    names = [i.strip() for i in config.get('ingestNodes', '').split(',')]
+    return [i for i in names if i]
+
+def getNodeConfig(config, name):
+    '''config for an extra node: the main config with the node's own
+    "<name>.<key>" settings on top'''
+    prefix = name + '.'
+    nodeConfig = dict(config)
+    for key, value in config.items():
+        if key.startswith(prefix):
+            nodeConfig[key[len(prefix):]] = value
+    return nodeConfig
@@ -1,11 +1,148 @@
+import atexit
+import gzip
+import os
+import shutil
+import threading
 import time
+import Queue
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING, 'ERROR': ERROR}
+
+class LogWriter:
+    '''Writes log lines for one file from a background thread.
+
+    The file is kept open and flushed after every batch of queued lines.
+    It is rotated when it reaches maxBytes or gets older than maxAge
+    seconds, and rotated files are gzipped. Only the newest backupCount
+    rotated files are kept, or all of them if backupCount is 0.'''
+    def __init__(self, logPath, maxBytes=0, maxAge=0, backupCount=0):
+        self.logPath = logPath
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.backupCount = backupCount
+        self.file = None
+        self.openTime = None
+        self.lines = Queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, line, echo=None):
+        '''queue line for the file, and echo for stdout'''
+        self.lines.put((line, echo))
+
+    def flush(self):
+        '''wait until every queued line has been written'''
+        self.lines.join()
+
+    def run(self):
+        while True:
+            batch = [self.lines.get()]
+            while True:
+                try:
+                    batch.append(self.lines.get_nowait())
+                except Queue.Empty:
+                    break
+
+            try:
+                self.writeBatch(batch)
+            except Exception as exception:
+                print 'log write failed, %s' %exception
+            finally:
+                for line in batch:
+                    self.lines.task_done()
+
+    def writeBatch(self, batch):
+        if self.file is None:
+            self.openFile()
+        for line, echo in batch:
+            if echo is not None:
+                print echo
+            self.file.write(line + '\n')
+        self.file.flush()
+
+        if self.shouldRotate():
+            self.rotate()
+
+    def openFile(self):
+        self.file = open(self.logPath, 'a')
+        if os.path.getsize(self.logPath):
+            self.openTime = os.path.getmtime(self.logPath)
+        else:
+            self.openTime = time.time()
+
+    def shouldRotate(self):
+        if self.maxBytes and self.file.tell() >= self.maxBytes:
+            return True
+        if self.maxAge and time.time() - self.openTime >= self.maxAge:
+            return True
+        return False
+
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        basePath = '%s.%s' %(self.logPath,
+                             time.strftime('%Y%m%d%H%M%S', time.gmtime()))
+        rotatedPath = basePath
+        suffix = 1
+        while os.path.exists(rotatedPath + '.gz'):
+            rotatedPath = '%s-%d' %(basePath, suffix)
+            suffix += 1
+        os.rename(self.logPath, rotatedPath)
+        with open(rotatedPath, 'rb') as source:
+            with gzip.open(rotatedPath + '.gz', 'wb') as target:
+                shutil.copyfileobj(source, target)
+        os.remove(rotatedPath)
+        self.removeOldBackups()
+        self.openFile()
+
+    def removeOldBackups(self):
+        if not self.backupCount: return
+        directory, name = os.path.split(os.path.abspath(self.logPath))
+        backups = [os.path.join(directory, i) for i in os.listdir(directory)
+                   if i.startswith(name + '.') and i.endswith('.gz')]
+        backups.sort(key=os.path.getmtime)
+        for backup in backups[:-self.backupCount]:
+            os.remove(backup)
+
+writers = {}
+writersLock = threading.Lock()
+
+def getWriter(logPath, maxBytes=0, maxAge=0, backupCount=0):
+    '''return the shared LogWriter for a file, updating its rotation
+    settings'''
+    key = os.path.abspath(logPath)
+    with writersLock:
+        if key not in writers:
+            writers[key] = LogWriter(key)
+        writer = writers[key]
+    writer.maxBytes = maxBytes
+    writer.maxAge = maxAge
+    writer.backupCount = backupCount
+    return writer
+
+def flushAll():
+    for writer in writers.values():
+        writer.flush()
+
+atexit.register(flushAll)
 
 class Logger:
-    def __init__(self, logPath):
+    def __init__(self, logPath, level=INFO, maxBytes=0, maxAge=0,
+                 backupCount=0):
         self.logPath = logPath
+        self.level = LEVELS.get(str(level).upper(), level)
+        self.writer = getWriter(logPath, maxBytes, maxAge, backupCount)
 
-    def log(self, message):
-        print message
-        with open(self.logPath, 'a') as file:
-            file.write('%s, %s\n' %(time.ctime(), message.encode('utf-8')))
+    def log(self, message, level=INFO):
+        if level < self.level: return
+        if isinstance(message, unicode):
+            message = message.encode('utf-8')
+        self.writer.write('%s, %s' %(time.ctime(), message), message)
 
+    def flush(self):
+        self.writer.flush()
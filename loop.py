@@ -1,28 +1,96 @@
 #!/usr/bin/python
 from BMaggregator import *
 from logger import Logger
+import signal
+import sys
 import time
 
 def check():
+    #the constructor adds the new messages, count them in the cycle
+    registry.startCycle()
+    startTime = time.time()
     bma = Aggregator()
-    return bma.check(addNewMessages=False)
+    return bma.check(addNewMessages=False, startTime=startTime)
 
 def logerror(exception):
     logger = Logger('logloopexceptions')
     args = [str(i) for i in exception.args]
     logger.log('loop Error!!, ' + ', '.join([str(type(exception)),]+args))
 
+def timeToNextCheck():
+    return Aggregator.CHECKINTERVAL-time.time()%Aggregator.CHECKINTERVAL
+
 def loop():
     while True:
         try:
             result = check()
         except Exception as exception:
             logerror(exception)
-            result = Aggregator.CHECKINTERVAL-time.time()%Aggregator.CHECKINTERVAL
+            result = timeToNextCheck()
 
         if result:
             print 'sleeping for ' + str(result)
             time.sleep(result)
 
+class Daemon:
+    '''Keeps one Aggregator and its indexes resident between checks.
+
+    The config is reloaded when the file changes or on SIGHUP. A failed
+    check rolls the Aggregator back to what is in the store.'''
+    def __init__(self):
+        self.bma = None
+        self.reloadRequested = False
+        signal.signal(signal.SIGHUP, self.requestReload)
+
+    def requestReload(self, signum, frame):
+        self.reloadRequested = True
+
+    def reloadIfNeeded(self):
+        if self.reloadRequested or self.bma.configChanged():
+            self.reloadRequested = False
+            self.bma.reloadConfig()
+
+    def check(self):
+        if self.bma is None:
+            #the constructor adds new messages
+            registry.startCycle()
+            startTime = time.time()
+            self.bma = Aggregator()
+            return self.bma.check(addNewMessages=False, startTime=startTime)
+
+        self.reloadIfNeeded()
+        return self.bma.check()
+
+    def sleep(self, duration):
+        wakeTime = time.time() + duration
+        while time.time() < wakeTime:
+            time.sleep(max(0, wakeTime - time.time()))
+            if self.reloadRequested and self.bma:
+                try:
+                    self.reloadIfNeeded()
+                except Exception as exception:
+                    logerror(exception)
+
+    def loop(self):
+        while True:
+            try:
+                result = self.check()
+            except Exception as exception:
+                logerror(exception)
+                if self.bma:
+                    try:
+                        self.bma.recover()
+                    except Exception as exception:
+                        logerror(exception)
+                        self.bma = None
+                result = timeToNextCheck()
+
+            if result:
+                print 'sleeping for ' + str(result)
+                self.sleep(result)
+
 if __name__ == '__main__':
-    loop()
+    if '-daemon' in sys.argv[1:]:
+        Daemon().loop()
+    else:
+        loop()
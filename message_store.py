@@ -0,0 +1,298 @@
+import sqlite3
+from histogram import HOUR, DAY
+
+class MessageStore:
+    '''SQLite backed storage for tracked messages.
+
+    Each message is written once, instead of in separate pickled copies.
+    The Aggregator loads the messages into its in-memory dicts and
+    TimeIndexes, which serve lookups by id, address, subject and time. The
+    SQL indexes only serve the store's own queries.'''
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.createTables()
+
+    def createTables(self):
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS messages (
+                msgid TEXT PRIMARY KEY,
+                fromAddress TEXT NOT NULL,
+                toAddress TEXT NOT NULL,
+                address TEXT NOT NULL,
+                receivedTime INTEGER NOT NULL,
+                subject TEXT NOT NULL,
+                firstChars BLOB NOT NULL,
+                trashed INTEGER NOT NULL DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS messagesByAddress
+                ON messages (address, receivedTime);
+            CREATE INDEX IF NOT EXISTS messagesByTime
+                ON messages (receivedTime);
+            CREATE INDEX IF NOT EXISTS messagesByTrashed
+                ON messages (trashed);
+            CREATE TABLE IF NOT EXISTS searchTerms (
+                term TEXT NOT NULL,
+                msgid TEXT NOT NULL,
+                weight INTEGER NOT NULL,
+                PRIMARY KEY (term, msgid));
+            CREATE INDEX IF NOT EXISTS searchTermsByMsgid
+                ON searchTerms (msgid);
+            CREATE TABLE IF NOT EXISTS subjectCounts (
+                resolution INTEGER NOT NULL,
+                address TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                subject TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                error INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (resolution, address, bucket, subject));
+            CREATE TABLE IF NOT EXISTS hourlyCounts (
+                address TEXT NOT NULL,
+                hour INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (address, hour));
+            CREATE TABLE IF NOT EXISTS dailyCounts (
+                address TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (address, day));
+            CREATE TABLE IF NOT EXISTS ignoredMessages (
+                node TEXT NOT NULL,
+                msgid TEXT NOT NULL,
+                toAddress TEXT NOT NULL,
+                fromAddress TEXT NOT NULL,
+                PRIMARY KEY (node, msgid));
+            CREATE TABLE IF NOT EXISTS distinctSketches (
+                resolution INTEGER NOT NULL,
+                address TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                registers BLOB NOT NULL,
+                PRIMARY KEY (resolution, address, bucket, kind));
+            ''')
+        self.connection.commit()
+
+    def isEmpty(self):
+        cursor = self.connection.execute('SELECT 1 FROM messages LIMIT 1')
+        return cursor.fetchone() is None
+
+    def addMessage(self, message, address):
+        self.connection.execute(
+            'INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (message.msgid, message.fromAddress, message.toAddress, address,
+             message.receivedTime, message.subject,
+             buffer(message.firstChars), int(message.trashed)))
+
+    def markTrashed(self, msgid):
+        self.connection.execute(
+            'UPDATE messages SET trashed = 1 WHERE msgid = ?', (msgid,))
+
+    def deleteMessages(self, msgids):
+        self.connection.executemany('DELETE FROM messages WHERE msgid = ?',
+                                    [(msgid,) for msgid in msgids])
+
+    def getSubjectSummaryRows(self, resolution, address, bucket):
+        '''yield (subject, count, error) tuples for one address's bucket'''
+        return iter(self.connection.execute(
+            'SELECT subject, count, error FROM subjectCounts '
+            'WHERE resolution = ? AND address = ? AND bucket = ?',
+            (resolution, address, bucket)))
+
+    def updateSubjectSummary(self, resolution, address, bucket, summary):
+        '''write the changed and removed subjects of a SpaceSaving summary
+        of one address's bucket'''
+        self.connection.executemany(
+            'DELETE FROM subjectCounts WHERE resolution = ? AND address = ? '
+            'AND bucket = ? AND subject = ?',
+            [(resolution, address, bucket, subject)
+             for subject in summary.removed])
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO subjectCounts VALUES (?, ?, ?, ?, ?, ?)',
+            [(resolution, address, bucket, subject, count, error)
+             for subject, count, error in summary.getRows(summary.changed)])
+
+    def hasSubjectCounts(self):
+        cursor = self.connection.execute('SELECT 1 FROM subjectCounts LIMIT 1')
+        return cursor.fetchone() is not None
+
+    def getSubjectCountRows(self, addresses, resolution, firstBucket,
+                            lastBucket):
+        '''yield (subject, count, error) tuples summed over the addresses'
+        buckets of one resolution in firstBucket <= bucket <= lastBucket'''
+        return iter(self.connection.execute(
+            'SELECT subject, SUM(count), SUM(error) FROM subjectCounts '
+            'WHERE resolution = ? AND address IN (%s) '
+            'AND bucket >= ? AND bucket <= ? GROUP BY subject'
+            %', '.join('?'*len(addresses)),
+            [resolution] + list(addresses) + [firstBucket, lastBucket]))
+
+    def getIgnoredMessages(self, node):
+        '''return {msgid: (toAddress, fromAddress)} of the untracked
+        messages already fetched from a node'''
+        return dict([(str(msgid), (str(toAddress), str(fromAddress)))
+                     for msgid, toAddress, fromAddress
+                     in self.connection.execute(
+                         'SELECT msgid, toAddress, fromAddress '
+                         'FROM ignoredMessages WHERE node = ?', (node,))])
+
+    def addIgnoredMessages(self, node, rows):
+        '''add (msgid, toAddress, fromAddress) rows for a node'''
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO ignoredMessages VALUES (?, ?, ?, ?)',
+            [(node,) + tuple(row) for row in rows])
+
+    def deleteIgnoredMessages(self, node, msgids):
+        self.connection.executemany(
+            'DELETE FROM ignoredMessages WHERE node = ? AND msgid = ?',
+            [(node, msgid) for msgid in msgids])
+
+    def getSketch(self, resolution, address, bucket, kind):
+        '''return the registers of one address's bucket's sketch, or None'''
+        row = self.connection.execute(
+            'SELECT registers FROM distinctSketches WHERE resolution = ? '
+            'AND address = ? AND bucket = ? AND kind = ?',
+            (resolution, address, bucket, kind)).fetchone()
+        return row and row[0]
+
+    def setSketch(self, resolution, address, bucket, kind, registers):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO distinctSketches VALUES (?, ?, ?, ?, ?)',
+            (resolution, address, bucket, kind, sqlite3.Binary(registers)))
+
+    def hasSketches(self):
+        cursor = self.connection.execute(
+            'SELECT 1 FROM distinctSketches LIMIT 1')
+        return cursor.fetchone() is not None
+
+    def getSketchRows(self, addresses, resolution, firstBucket, lastBucket,
+                      kind):
+        '''yield the registers of the addresses' sketches of one kind and
+        resolution in firstBucket <= bucket <= lastBucket'''
+        return (row[0] for row in self.connection.execute(
+            'SELECT registers FROM distinctSketches '
+            'WHERE resolution = ? AND address IN (%s) '
+            'AND bucket >= ? AND bucket <= ? AND kind = ?'
+            %', '.join('?'*len(addresses)),
+            [resolution] + list(addresses) + [firstBucket, lastBucket, kind]))
+
+    def addSearchTerms(self, msgid, termWeights):
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO searchTerms VALUES (?, ?, ?)',
+            [(term, msgid, weight) for term, weight in termWeights.items()])
+
+    def deleteSearchTerms(self, msgids):
+        self.connection.executemany('DELETE FROM searchTerms WHERE msgid = ?',
+                                    [(msgid,) for msgid in msgids])
+
+    def hasSearchTerms(self):
+        cursor = self.connection.execute('SELECT 1 FROM searchTerms LIMIT 1')
+        return cursor.fetchone() is not None
+
+    def getMessageCount(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def getTermCounts(self, terms):
+        '''yield (term, number of messages containing term) tuples'''
+        return iter(self.connection.execute(
+            'SELECT term, COUNT(*) FROM searchTerms WHERE term IN (%s) '
+            'GROUP BY term' %', '.join('?'*len(terms)), terms))
+
+    def getSearchRows(self, terms, addresses=None, startTime=0,
+                      endTime=None):
+        '''yield (msgid, receivedTime, term, weight) tuples for messages in
+        the time window, from the given addresses, containing any of
+        terms'''
+        query = ('SELECT searchTerms.msgid, receivedTime, term, weight '
+                 'FROM searchTerms JOIN messages USING (msgid) '
+                 'WHERE term IN (%s) AND receivedTime >= ?'
+                 %', '.join('?'*len(terms)))
+        args = list(terms) + [startTime]
+        if endTime is not None and endTime != '':
+            query += ' AND receivedTime <= ?'
+            args.append(endTime)
+        if addresses is not None:
+            query += ' AND address IN (%s)' %', '.join('?'*len(addresses))
+            args += list(addresses)
+        return iter(self.connection.execute(query, args))
+
+    def getUntrashedIds(self):
+        cursor = self.connection.execute(
+            'SELECT msgid FROM messages WHERE trashed = 0')
+        return [row[0] for row in cursor]
+
+    def addHourlyCount(self, address, hour, count=1):
+        self.connection.execute(
+            'INSERT OR IGNORE INTO hourlyCounts VALUES (?, ?, 0)',
+            (address, hour))
+        self.connection.execute(
+            'UPDATE hourlyCounts SET count = count + ? '
+            'WHERE address = ? AND hour = ?', (count, address, hour))
+
+    def hasHourlyCounts(self):
+        cursor = self.connection.execute(
+            'SELECT 1 FROM hourlyCounts UNION ALL '
+            'SELECT 1 FROM dailyCounts LIMIT 1')
+        return cursor.fetchone() is not None
+
+    def getHourlyCountRows(self):
+        '''yield (address, hour, count) tuples'''
+        return iter(self.connection.execute(
+            'SELECT address, hour, count FROM hourlyCounts'))
+
+    def getDailyCountRows(self):
+        '''yield (address, day, count) tuples of the days whose hours were
+        pruned'''
+        return iter(self.connection.execute(
+            'SELECT address, day, count FROM dailyCounts'))
+
+    def pruneHours(self, cutoff):
+        '''fold the hourly counts before cutoff, a day boundary, into
+        daily counts, and drop the hour resolution subject counts and
+        sketches before it'''
+        rows = self.connection.execute(
+            'SELECT address, hour/%d*%d, SUM(count) FROM hourlyCounts '
+            'WHERE hour < ? GROUP BY 1, 2' %(DAY, DAY), (cutoff,)).fetchall()
+        self.connection.executemany(
+            'INSERT OR IGNORE INTO dailyCounts VALUES (?, ?, 0)',
+            [row[:2] for row in rows])
+        self.connection.executemany(
+            'UPDATE dailyCounts SET count = count + ? '
+            'WHERE address = ? AND day = ?',
+            [(count, address, day) for address, day, count in rows])
+        self.connection.execute('DELETE FROM hourlyCounts WHERE hour < ?',
+                                (cutoff,))
+        for table in ('subjectCounts', 'distinctSketches'):
+            self.connection.execute(
+                'DELETE FROM %s WHERE resolution = ? AND bucket < ?' %table,
+                (HOUR, cutoff))
+
+    def getMessageRows(self):
+        '''yield (msgid, fromAddress, toAddress, address, receivedTime,
+        subject, firstChars, trashed) tuples, oldest first'''
+        cursor = self.connection.execute(
+            'SELECT msgid, fromAddress, toAddress, address, receivedTime, '
+            'subject, firstChars, trashed FROM messages '
+            'ORDER BY receivedTime, rowid')
+        for row in cursor:
+            yield row
+
+    def getMessageRowsById(self, msgids):
+        '''return a dict mapping each stored msgid of msgids to its
+        getMessageRows tuple'''
+        msgids = list(msgids)
+        if not msgids:
+            return {}
+        cursor = self.connection.execute(
+            'SELECT msgid, fromAddress, toAddress, address, receivedTime, '
+            'subject, firstChars, trashed FROM messages '
+            'WHERE msgid IN (%s)' %', '.join('?'*len(msgids)), msgids)
+        return dict([(str(row[0]), row) for row in cursor])
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,158 @@
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CALLBUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+               60)
+PHASEBUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0]*len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    '''Counters, gauges and latency histograms for check cycles and api
+    calls, rendered in the Prometheus text format.
+
+    Metrics are keyed by name and a tuple of (label, value) pairs. The
+    cycle totals are reset by startCycle and summarized by
+    getCycleSummary.'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.startCycle()
+
+    def increment(self, name, labels=(), value=1):
+        with self.lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def setGauge(self, name, value, labels=()):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def observe(self, name, value, labels=(), buckets=CALLBUCKETS):
+        with self.lock:
+            key = (name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def observePhase(self, phase, seconds):
+        self.observe('bma_phase_seconds', seconds, (('phase', phase),),
+                     PHASEBUCKETS)
+        with self.lock:
+            self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def observeCall(self, methodName, seconds, failed=False):
+        result = 'error' if failed else 'ok'
+        self.increment('bma_api_calls_total',
+                       (('method', methodName), ('result', result)))
+        self.observe('bma_api_call_seconds', seconds,
+                     (('method', methodName),))
+        with self.lock:
+            self.calls += 1
+            self.callErrors += failed
+            self.callSeconds += seconds
+
+    def startCycle(self):
+        with self.lock:
+            self.phases = OrderedDict()
+            self.calls = 0
+            self.callErrors = 0
+            self.callSeconds = 0.0
+
+    def getCycleSummary(self):
+        '''one line with the time of each phase and the api calls made
+        since startCycle. Phases are nested, so the times overlap.'''
+        with self.lock:
+            parts = ['%s %.2fs' %(phase, seconds)
+                     for phase, seconds in self.phases.items()]
+            parts.append('api calls %d, api errors %d, api time %.2fs'
+                         %(self.calls, self.callErrors, self.callSeconds))
+        return ', '.join(parts)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metricType, metrics in (('counter', self.counters),
+                                        ('gauge', self.gauges)):
+                lastName = None
+                for (name, labels), value in sorted(metrics.items()):
+                    if name != lastName:
+                        lines.append('# TYPE %s %s' %(name, metricType))
+                        lastName = name
+                    lines.append('%s%s %s' %(name, formatLabels(labels),
+                                             formatValue(value)))
+
+            lastName = None
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name != lastName:
+                    lines.append('# TYPE %s histogram' %name)
+                    lastName = name
+                cumulative = 0
+                for bucket, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    bucketLabels = labels + (('le', formatValue(bucket)),)
+                    lines.append('%s_bucket%s %d' %(name,
+                                                    formatLabels(bucketLabels),
+                                                    cumulative))
+                bucketLabels = labels + (('le', '+Inf'),)
+                lines.append('%s_bucket%s %d' %(name, formatLabels(bucketLabels),
+                                                histogram.count))
+                lines.append('%s_sum%s %s' %(name, formatLabels(labels),
+                                             formatValue(histogram.sum)))
+                lines.append('%s_count%s %d' %(name, formatLabels(labels),
+                                               histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def writeFile(self, filePath):
+        '''write the metrics to filePath, replacing it in one step so
+        readers never see half a file'''
+        temporaryPath = filePath + '.tmp'
+        with open(temporaryPath, 'w') as file:
+            file.write(self.render())
+        os.rename(temporaryPath, filePath)
+
+def formatLabels(labels):
+    if not labels:
+        return ''
+    escaped = [(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+               for label, value in labels]
+    return '{%s}' %','.join(['%s="%s"' %i for i in escaped])
+
+def formatValue(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+#shared by every Aggregator and ApiUser in the process
+registry = Metrics()
+
+def timedPhase(method):
+    '''record the time each call of method takes as a phase named after
+    it'''
+    def timedMethod(*args, **kwargs):
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            registry.observePhase(method.__name__, time.time() - start)
+    timedMethod.__name__ = method.__name__
+    timedMethod.__doc__ = method.__doc__
+    return timedMethod
@@ -0,0 +1,173 @@
+import os
+import time
+import json
+import errno
+import socket
+import hashlib
+from worker_pool import WorkerPool
+from logger import WARNING
+
+#connect errors, raised before any of the request is written
+UNSENTERRORS = (errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH,
+                errno.EADDRNOTAVAIL)
+
+def isUnsent(exception):
+    '''whether a failed send certainly never reached the node. Anything
+    else, a timeout or a dropped connection, may have been after the node
+    took the message, so it isn't safe to send again.'''
+    if isinstance(exception, socket.gaierror):
+        return True
+    return (isinstance(exception, socket.error) and
+            not isinstance(exception, socket.timeout) and
+            exception.errno in UNSENTERRORS)
+
+class Send:
+    '''One rendered outbound message, a broadcast if toAddress is None.
+
+    After it is dispatched, result holds the node's answer, or error the
+    exception of the last failed attempt, and skipped is set if it wasn't
+    sent because it was unchanged. A message with a minInterval is not
+    resent, even if it changed, until minInterval seconds after it was
+    last sent. The volatile strings, such as a report's time window, are
+    left out when comparing contents.'''
+    def __init__(self, fromAddress, subject, message, toAddress=None,
+                 minInterval=0):
+        self.fromAddress = fromAddress
+        self.subject = subject
+        self.message = message
+        self.toAddress = toAddress
+        self.minInterval = minInterval
+        self.result = None
+        self.error = None
+        self.attempts = 0
+        self.skipped = False
+        self.volatile = ()
+
+    def getDestination(self):
+        return self.toAddress or '[Broadcast subscribers]'
+
+    def getKey(self):
+        '''the key of the last sent content of this destination and
+        subject'''
+        return '%s %s %s' %(self.fromAddress, self.getDestination(),
+                            self.subject)
+
+    def getHash(self):
+        content = self.message
+        for string in self.volatile:
+            content = content.replace(string, '')
+        return hashlib.sha1(content).hexdigest()
+
+class SendError(Exception):
+    '''Raised when some sends still failed after every retry.'''
+    def __init__(self, failed):
+        Exception.__init__(self, '%d sends failed, first: %s'
+                           %(len(failed), failed[0].error))
+        self.failed = failed
+
+class Dispatcher:
+    '''Sends rendered messages concurrently on a bounded pool of worker
+    threads.
+
+    Messages are rendered before they are dispatched, so a send that
+    couldn't connect to the node is retried, with exponential backoff,
+    without rendering anything again. Other failures are not retried, so
+    a message is never sent twice.
+
+    Every send costs proof of work, so the hash and time of the last
+    content sent to each destination and subject are kept in hashPath,
+    and a send whose content is unchanged is skipped.'''
+    def __init__(self, apiUser, logger, workers=4, retries=2, backoff=5.0,
+                 hashPath=None):
+        self.apiUser = apiUser
+        self.logger = logger
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.hashPath = hashPath
+
+    def loadHashes(self):
+        '''return the {key: [hash, time]} of the last sent contents'''
+        if not self.hashPath or not os.path.isfile(self.hashPath):
+            return {}
+        try:
+            with open(self.hashPath, 'r') as file:
+                return json.load(file)
+        except ValueError as exception:
+            self.logger.log('sent hashes unreadable, %s' %exception, WARNING)
+            return {}
+
+    def saveHashes(self, sends):
+        '''record the content of the sends that went through'''
+        if not self.hashPath: return
+        #reread, another process may share the file
+        hashes = self.loadHashes()
+        for send in sends:
+            if send.attempts and not send.error:
+                hashes[send.getKey()] = [send.getHash(), time.time()]
+
+        temporaryPath = self.hashPath + '.tmp'
+        try:
+            with open(temporaryPath, 'w') as file:
+                json.dump(hashes, file)
+            os.rename(temporaryPath, self.hashPath)
+        except (IOError, OSError) as exception:
+            self.logger.log('sent hashes write failed, %s' %exception,
+                            WARNING)
+
+    def isUnchanged(self, send, hashes):
+        if send.getKey() not in hashes:
+            return False
+        lastHash, lastTime = hashes[send.getKey()]
+        return (lastHash == send.getHash() or
+                time.time() < lastTime + send.minInterval)
+
+    def deliver(self, send):
+        send.attempts += 1
+        if send.toAddress is None:
+            return self.apiUser.sendBroadcast(send.fromAddress, send.subject,
+                                              send.message)
+        return self.apiUser.sendMessage(send.toAddress, send.fromAddress,
+                                        send.subject, send.message)
+
+    def dispatch(self, sends):
+        '''send every Send, setting its result or error, and raise
+        SendError if any of them failed'''
+        hashes = self.loadHashes()
+        pending = []
+        for send in sends:
+            if self.isUnchanged(send, hashes):
+                send.skipped = True
+                self.logger.log('send skipped, %s, %s'
+                                %(send.getDestination(), send.subject))
+            else:
+                pending.append(send)
+        if not pending: return
+
+        pool = WorkerPool(min(self.workers, len(pending)))
+        try:
+            for attempt in range(self.retries+1):
+                if attempt:
+                    time.sleep(self.backoff * 2**(attempt-1))
+                futures = [(send, pool.submit(self.deliver, send))
+                           for send in pending]
+                pending = []
+                for send, future in futures:
+                    try:
+                        send.result = future.result()
+                        send.error = None
+                    except Exception as exception:
+                        send.error = exception
+                        self.logger.log('send failed, %s, %s, %s'
+                                        %(send.getDestination(), send.subject,
+                                          exception), WARNING)
+                        if isUnsent(exception):
+                            pending.append(send)
+                if not pending: break
+        finally:
+            pool.shutdown(wait=False)
+            self.saveHashes(sends)
+
+        failed = [send for send in sends if send.error]
+        if failed:
+            raise SendError(failed)
@@ -0,0 +1,150 @@
+class ReportSnapshot:
+    '''Everything the reports for one time window are built from.
+
+    The chan and subscription lists are read once when the snapshot is
+    created. Counts, subject tables and rendered sections are computed the
+    first time they are asked for and shared by every report rendered from
+    the same snapshot.'''
+    def __init__(self, aggregator, startTime, endTime):
+        self.aggregator = aggregator
+        self.startTime = startTime
+        self.endTime = endTime
+        self.startTimeString, self.endTimeString = \
+            aggregator.getTimeStrings(startTime, endTime)
+        self.chanLabels = aggregator.getChanLabels()
+        self.subscriptions = aggregator.getSubscriptions()
+        self.sections = {}
+
+    def getSection(self, key, build, *args):
+        key = (key,) + args
+        if key not in self.sections:
+            self.sections[key] = build(*args)
+        return self.sections[key]
+
+    def getChanCounts(self):
+        return self.getSection('chanCounts', self.buildChanCounts)
+
+    def buildChanCounts(self):
+        chans = self.aggregator.getLabelCounts(self.chanLabels,
+                                               self.startTime, self.endTime)
+        if self.aggregator.config.get('chanRanking') == 'posters':
+            chans.sort(key=lambda chan:
+                           (self.getDistinctCounts(chan[1])[0], chan),
+                       reverse = True)
+        else:
+            chans.sort(reverse = True)
+        return chans
+
+    def getBroadcastCounts(self):
+        return self.getSection('broadcastCounts', self.buildBroadcastCounts)
+
+    def buildBroadcastCounts(self):
+        broadcasts = self.aggregator.getMessageCounts(self.subscriptions,
+                                                      self.startTime,
+                                                      self.endTime)
+        broadcasts.sort(reverse = True)
+        return broadcasts
+
+    def getSubjectCounts(self, addresses):
+        return self.getSection('subjectCounts', self.buildSubjectCounts,
+                               tuple(addresses))
+
+    def buildSubjectCounts(self, addresses):
+        return self.aggregator.getSubjectCounts(addresses, self.startTime,
+                                                self.endTime)
+
+    def getDistinctCounts(self, addresses):
+        return self.getSection('distinctCounts', self.buildDistinctCounts,
+                               tuple(addresses))
+
+    def buildDistinctCounts(self, addresses):
+        return self.aggregator.getDistinctCounts(addresses, self.startTime,
+                                                 self.endTime)
+
+    def getHeader(self, filePath):
+        return self.getSection('header', self.buildHeader, filePath)
+
+    def buildHeader(self, filePath):
+        return self.aggregator.getText(filePath,
+                                       startTimeString=self.startTimeString,
+                                       endTimeString=self.endTimeString,
+                                       **self.aggregator.config)
+
+    def getRawChanSubjectReport(self, numberOfSubjectsToList=20):
+        return self.getSection('rawChanSubjectReport',
+                               self.buildRawChanSubjectReport,
+                               numberOfSubjectsToList)
+
+    def buildRawChanSubjectReport(self, numberOfSubjectsToList):
+        report = u''
+        for count, addresses, label in self.getChanCounts():
+            chanSection = u'Name: %s\n' %label
+            chanSection += self.aggregator.SEPERATOR*(6+len(label))+u'\n'
+            chanSection += u'Addresses:\n'
+
+            for address in addresses:
+                chanSection += u'  %s\n' %address
+
+            chanSection += u'\nMessages Seen: %d\n' %count
+            chanSection += (u'Distinct Posters: ~%d\nDistinct Threads: ~%d\n\n'
+                            %self.getDistinctCounts(addresses))
+
+            subjectCounts, approximate = self.getSubjectCounts(addresses)
+            chanSection += self.aggregator.getSubjectTable(
+                subjectCounts, numberOfSubjectsToList, key=lambda x: x.lower(),
+                approximate=approximate)
+
+            report += chanSection + u'\n\n'
+
+        return report
+
+    def getRawBroadcastSubjectReport(self, numberOfSubjectsToList=20):
+        return self.getSection('rawBroadcastSubjectReport',
+                               self.buildRawBroadcastSubjectReport,
+                               numberOfSubjectsToList)
+
+    def buildRawBroadcastSubjectReport(self, numberOfSubjectsToList):
+        report = u''
+        for count, address, label in self.getBroadcastCounts():
+            broadcastSection = u'Name: %s\n' %label
+            broadcastSection += self.aggregator.SEPERATOR*(6+len(label))+u'\n'
+            broadcastSection += u'Address: %s\n\n' %address
+            #a subscription only has one poster, the subscribed address
+            broadcastSection += (u'Distinct Threads: ~%d\n\n'
+                                 %self.getDistinctCounts([address])[1])
+
+            subjectCounts, approximate = self.getSubjectCounts([address])
+            broadcastSection += self.aggregator.getSubjectTable(
+                subjectCounts, numberOfSubjectsToList,
+                approximate=approximate)
+
+            report += broadcastSection + u'\n\n'
+
+        return report
+
+    def getMainReport(self):
+        return self.getSection('mainReport', self.buildMainReport)
+
+    def buildMainReport(self):
+        report = self.getHeader('reportheaders/mainReport')
+        report += u'\n\nChans:\n======\n\n'
+        report += self.getRawChanSubjectReport()
+        report += u'\nBroadcasts:\n===========\n\n'
+        report += self.getRawBroadcastSubjectReport()
+        return report
+
+    def getChanSubjectReport(self):
+        return self.getSection('chanSubjectReport',
+                               self.buildChanSubjectReport)
+
+    def buildChanSubjectReport(self):
+        return (self.getHeader('reportheaders/chanReport') + u'\n\n' +
+                self.getRawChanSubjectReport())
+
+    def getBroadcastSubjectReport(self):
+        return self.getSection('broadcastSubjectReport',
+                               self.buildBroadcastSubjectReport)
+
+    def buildBroadcastSubjectReport(self):
+        return (self.getHeader('reportheaders/broadcastReport') + u'\n\n' +
+                self.getRawBroadcastSubjectReport())
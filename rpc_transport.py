@@ -0,0 +1,99 @@
+import errno
+import httplib
+import socket
+import threading
+import xmlrpclib
+
+class PooledTransport(xmlrpclib.Transport):
+    '''XML-RPC transport that keeps a pool of keep-alive HTTP connections.
+
+    A connection is only used by one request at a time, so a single
+    transport, and the ServerProxy using it, can be shared by threads. At
+    most poolSize requests are in flight at once.'''
+    def __init__(self, poolSize=4, timeout=60):
+        xmlrpclib.Transport.__init__(self)
+        self.verbose = 0
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max(1, poolSize))
+        self.local = threading.local()
+
+    def setCallTimeout(self, timeout):
+        '''set the timeout for requests made from the current thread'''
+        self.local.timeout = timeout
+
+    def getConnection(self, host):
+        '''return (connection, reused) for host'''
+        with self.lock:
+            for i, (idleHost, connection) in enumerate(self.idle):
+                if idleHost == host:
+                    del self.idle[i]
+                    return connection, True
+
+        chost, extraHeaders, x509 = self.get_host_info(host)
+        return httplib.HTTPConnection(chost, timeout=self.timeout), False
+
+    def releaseConnection(self, host, connection):
+        with self.lock:
+            self.idle.append((host, connection))
+
+    def request(self, host, handler, request_body, verbose=0):
+        self.slots.acquire()
+        try:
+            connection, reused = self.getConnection(host)
+            try:
+                return self.pooledRequest(connection, host, handler,
+                                          request_body)
+            except (socket.error, httplib.BadStatusLine) as exception:
+                #the server may have closed an idle connection
+                if not reused or not self.isStale(exception):
+                    raise
+            connection, reused = self.getConnection(host)
+            return self.pooledRequest(connection, host, handler, request_body)
+        finally:
+            self.slots.release()
+
+    def isStale(self, exception):
+        if isinstance(exception, httplib.BadStatusLine):
+            return True
+        return exception.errno in (errno.ECONNRESET, errno.ECONNABORTED,
+                                   errno.EPIPE)
+
+    def pooledRequest(self, connection, host, handler, request_body):
+        timeout = getattr(self.local, 'timeout', None) or self.timeout
+        connection.timeout = timeout
+        if connection.sock:
+            connection.sock.settimeout(timeout)
+
+        try:
+            self.send_request(connection, handler, request_body)
+            chost, extraHeaders, x509 = self.get_host_info(host)
+            for key, value in extraHeaders or []:
+                connection.putheader(key, value)
+            self.send_user_agent(connection)
+            self.send_content(connection, request_body)
+
+            response = connection.getresponse(buffering=True)
+            if response.status == 200:
+                result = self.parse_response(response)
+                self.releaseConnection(host, connection)
+                return result
+        except xmlrpclib.Fault:
+            self.releaseConnection(host, connection)
+            raise
+        except Exception:
+            connection.close()
+            raise
+
+        response.read()
+        connection.close()
+        raise xmlrpclib.ProtocolError(host + handler, response.status,
+                                      response.reason, response.msg)
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for host, connection in idle:
+            connection.close()
@@ -0,0 +1,52 @@
+#!/usr/bin/python
+import sys
+import time
+from BMaggregator import *
+
+USAGE = '''search.py [-chan <label>] [-address <address>] [-hours <n>]
+          [-limit <n>] <words>'''
+
+args = sys.argv[1:]
+options = {}
+words = []
+while args:
+    arg = args.pop(0)
+    if arg in ('-chan', '-address', '-hours', '-limit') and args:
+        options[arg] = args.pop(0)
+    else:
+        words.append(arg.decode('utf-8'))
+
+if not words:
+    print USAGE
+    sys.exit(1)
+
+#search the stored messages without starting an Aggregator, which would
+#fetch new messages from the node
+registry = BMAMaster().addressRegistry
+store = MessageStore('data/messages.db')
+searchIndex = SearchIndex(store)
+addresses = None
+if '-chan' in options:
+    addresses = registry.getChanLabels().get(
+        options['-chan'].decode('utf-8'), [])
+if '-address' in options:
+    addresses = (addresses or []) + [options['-address']]
+
+startTime = 0
+if '-hours' in options:
+    startTime = time.time() - float(options['-hours'])*3600
+
+results = searchIndex.search(u' '.join(words), addresses, startTime,
+                             limit=int(options.get('-limit', 20)))
+rows = store.getMessageRowsById([msgid for score, msgid in results])
+store.close()
+labels = registry.getChanAddresses()
+labels.update(registry.getSubscriptions())
+for score, msgid in results:
+    if msgid not in rows: continue
+    address = rows[msgid][3]
+    message = Message.fromRow(rows[msgid])
+    print '%.2f\t%s\t%s\t%s' %(score, time.asctime(time.gmtime(message.receivedTime)),
+                               labels.get(address, address).encode('utf-8'),
+                               message.subject.encode('utf-8'))
+    print '\t' + message.firstChars.decode('utf-8', 'replace').encode('utf-8').replace('\n', ' ')
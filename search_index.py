@@ -0,0 +1,64 @@
+import math
+import re
+from collections import Counter
+
+TOKENPATTERN = re.compile(r'\w+', re.UNICODE)
+SUBJECTWEIGHT = 3
+
+def tokenize(text):
+    '''split text into normalized search terms'''
+    return TOKENPATTERN.findall(text.lower())
+
+def getTermWeights(message):
+    '''return a Counter of term weights for a message, with subject terms
+    counting SUBJECTWEIGHT times as much as terms in the preview'''
+    weights = Counter()
+    for term in tokenize(message.subject):
+        weights[term] += SUBJECTWEIGHT
+    for term in tokenize(message.firstChars.decode('utf-8', 'replace')):
+        weights[term] += 1
+    return weights
+
+class SearchIndex:
+    '''Inverted index over message subjects and previews, kept in the
+    searchTerms table of a MessageStore.'''
+    def __init__(self, store):
+        self.store = store
+
+    def addMessage(self, message):
+        self.store.addSearchTerms(message.msgid, getTermWeights(message))
+
+    def removeMessages(self, msgids):
+        self.store.deleteSearchTerms(msgids)
+
+    def search(self, query, addresses=None, startTime=0, endTime=None,
+               limit=20):
+        '''return up to limit (score, msgid) pairs for messages containing
+        every term of query, best first
+
+        Scores add up term weights scaled by inverse document frequency,
+        so rare terms count for more.'''
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+
+        messageCount = max(1, self.store.getMessageCount())
+        idf = dict([(term, math.log(1.0 + float(messageCount)/max(1, count)))
+                    for term, count in self.store.getTermCounts(terms)])
+
+        scores = Counter()
+        matches = Counter()
+        receivedTimes = {}
+        for msgid, receivedTime, term, weight in self.store.getSearchRows(
+                terms, addresses, startTime, endTime):
+            scores[msgid] += weight*idf.get(term, 0)
+            matches[msgid] += 1
+            receivedTimes[msgid] = receivedTime
+
+        #ties go to the newer message
+        results = [(score, receivedTimes[msgid], msgid)
+                   for msgid, score in scores.iteritems()
+                   if matches[msgid] == len(terms)]
+        results.sort(reverse=True)
+        return [(score, msgid) for score, receivedTime, msgid
+                in results[:limit]]
@@ -0,0 +1,53 @@
+import os
+import re
+
+PLACEHOLDER = re.compile(r'\$(\w+)')
+
+class TemplateError(Exception):
+    pass
+
+class Template:
+    '''A text file with $name placeholders.
+
+    The file is split once into literal text and placeholder names, so
+    rendering is a join. It is read again if its mtime changes.'''
+    def __init__(self, filePath):
+        self.filePath = filePath
+        self.mtime = None
+        self.parts = []
+
+    def load(self):
+        mtime = os.path.getmtime(self.filePath)
+        with open(self.filePath, 'r') as file:
+            rawText = file.read()
+
+        parts = []
+        position = 0
+        for match in PLACEHOLDER.finditer(rawText):
+            parts.append((False, rawText[position:match.start()]))
+            parts.append((True, match.group(1)))
+            position = match.end()
+        parts.append((False, rawText[position:]))
+
+        self.parts = parts
+        self.mtime = mtime
+
+    def render(self, **args):
+        if os.path.getmtime(self.filePath) != self.mtime:
+            self.load()
+
+        try:
+            return ''.join([args[text] if isPlaceholder else text
+                            for isPlaceholder, text in self.parts])
+        except KeyError as exception:
+            raise TemplateError('No value for $%s in template %s'
+                                %(exception.args[0], self.filePath))
+
+templates = {}
+
+def getTemplate(filePath):
+    '''return the cached Template for a file'''
+    key = os.path.abspath(filePath)
+    if key not in templates:
+        templates[key] = Template(key)
+    return templates[key]
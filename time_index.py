@@ -0,0 +1,65 @@
+import bisect
+from array import array
+
+class TimeIndex:
+    '''A list of messages kept sorted by integer receivedTime.
+
+    Window queries are two binary searches and a slice. Adding messages in
+    time order is an append.'''
+    def __init__(self, messages=()):
+        self.times = array('l')
+        self.items = []
+        for message in messages:
+            self.add(message)
+
+    def add(self, message):
+        receivedTime = message.receivedTime
+        if not self.times or receivedTime >= self.times[-1]:
+            self.times.append(receivedTime)
+            self.items.append(message)
+        else:
+            i = bisect.bisect_right(self.times, receivedTime)
+            self.times.insert(i, receivedTime)
+            self.items.insert(i, message)
+
+    def countBefore(self, timestamp):
+        '''number of messages received strictly before timestamp'''
+        return bisect.bisect_left(self.times, timestamp)
+
+    def countUpTo(self, timestamp):
+        '''number of messages received at or before timestamp'''
+        if timestamp is None or timestamp == '':
+            return len(self.times)
+        return bisect.bisect_right(self.times, timestamp)
+
+    def window(self, startTime=0, endTime=None):
+        '''messages with startTime <= receivedTime <= endTime'''
+        return self.items[self.countBefore(startTime):self.countUpTo(endTime)]
+
+    def count(self, startTime=0, endTime=None):
+        return max(0, self.countUpTo(endTime) - self.countBefore(startTime))
+
+    def removeBefore(self, timestamp, keep=None):
+        '''remove the messages received before timestamp, except those for
+        which keep(message) is true, and return the removed ones'''
+        end = self.countBefore(timestamp)
+        removed = []
+        keptTimes = array('l')
+        keptItems = []
+        for i in xrange(end):
+            message = self.items[i]
+            if keep and keep(message):
+                keptTimes.append(self.times[i])
+                keptItems.append(message)
+            else:
+                removed.append(message)
+
+        self.times = keptTimes + self.times[end:]
+        self.items = keptItems + self.items[end:]
+        return removed
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
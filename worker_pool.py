@@ -0,0 +1,78 @@
+import sys
+import threading
+import time
+import Queue
+
+class Future:
+    '''The result of a call submitted to a WorkerPool.'''
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.excInfo = None
+
+    def setResult(self, value):
+        self.value = value
+        self.event.set()
+
+    def setException(self, excInfo):
+        self.excInfo = excInfo
+        self.event.set()
+
+    def done(self):
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        if not self.event.wait(timeout):
+            raise RuntimeError('Timed out waiting for result')
+        if self.excInfo:
+            raise self.excInfo[0], self.excInfo[1], self.excInfo[2]
+        return self.value
+
+class WorkerPool:
+    '''A fixed number of daemon threads running submitted calls.'''
+    def __init__(self, workers=4):
+        self.tasks = Queue.Queue()
+        self.threads = []
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+
+            future, function, args, kwargs = task
+            try:
+                future.setResult(function(*args, **kwargs))
+            except Exception:
+                future.setException(sys.exc_info())
+
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        self.tasks.put((future, function, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        '''stop the threads once the queued calls are done, waiting for
+        them unless wait is false'''
+        for thread in self.threads:
+            self.tasks.put(None)
+        if not wait: return
+        for thread in self.threads:
+            thread.join()
+
+def callWithRetry(function, args=(), retries=3, backoff=1.0,
+                  exceptions=(Exception,)):
+    '''call function, retrying with exponential backoff if it raises one
+    of exceptions'''
+    for attempt in range(retries+1):
+        try:
+            return function(*args)
+        except exceptions:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2**attempt)